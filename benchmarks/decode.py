@@ -0,0 +1,85 @@
+"""
+Compares the throughput of decoding audio for speech recognition, reading
+WAV files directly in Python against converting them with ffmpeg.
+
+Usage: poetry run python -m benchmarks.decode [--buffer-size 32000] [FILE]
+
+Without a file a synthetic recording (44.1khz, stereo, 16bit) is generated
+first, similar to the ones stored after an upload.
+"""
+import time
+import wave
+
+import click
+import numpy as np
+
+from tinychronicler.generator.decoder import read_ffmpeg, read_wav
+from tinychronicler.generator.notes import BUFFER_SIZE, SAMPLE_RATE
+from tinychronicler.helpers import temporary_file
+
+# Synthetic recordings are written in blocks of this duration (in seconds),
+# this way long ones do not need to fit into memory
+BLOCK_DURATION = 10.0
+
+
+def generate_wav(file_path: str, duration: float, rate=44100):
+    rng = np.random.default_rng(0)
+    total_frames = int(duration * rate)
+    block_frames = int(BLOCK_DURATION * rate)
+    with wave.open(file_path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        for start in range(0, total_frames, block_frames):
+            t = np.arange(start, min(start + block_frames, total_frames))
+            t = t / rate
+            signal = (0.3 * np.sin(2 * np.pi * 220 * t) +
+                      0.1 * rng.standard_normal(len(t)))
+            frames = np.stack([signal, signal], axis=1) * 32767 * 0.5
+            f.writeframes(frames.astype("<i2").tobytes())
+
+
+def measure(name: str, blocks, duration: float):
+    start = time.perf_counter()
+    total = 0
+    for data in blocks:
+        total += len(data)
+    elapsed = time.perf_counter() - start
+    print("{:<8} {:8.3f}s {:8.1f}MB/s {:8.1f}x realtime".format(
+        name,
+        elapsed,
+        total / elapsed / 1000 / 1000,
+        duration / elapsed))
+
+
+def run(file_path: str, buffer_size: int, repeat: int):
+    with wave.open(file_path, "rb") as f:
+        duration = f.getnframes() / f.getframerate()
+    print("File: {} ({:0.1f}s), buffer size: {} bytes".format(
+        file_path, duration, buffer_size))
+    for _ in range(repeat):
+        measure("wav", read_wav(file_path, SAMPLE_RATE, buffer_size),
+                duration)
+        measure("ffmpeg", read_ffmpeg(file_path, SAMPLE_RATE, buffer_size),
+                duration)
+
+
+@click.command()
+@click.option("--buffer-size", type=int, default=BUFFER_SIZE,
+              show_default=True, help="Buffer size in bytes.")
+@click.option("--duration", type=float, default=300.0, show_default=True,
+              help="Duration of synthetic recording in seconds.")
+@click.option("--repeat", type=int, default=3, show_default=True,
+              help="Number of runs per decoder.")
+@click.argument("file", required=False)
+def main(buffer_size: int, duration: float, repeat: int, file: str):
+    if file is not None:
+        run(file, buffer_size, repeat)
+        return
+    with temporary_file(".wav") as file_path:
+        generate_wav(file_path, duration)
+        run(file_path, buffer_size, repeat)
+
+
+if __name__ == "__main__":
+    main()
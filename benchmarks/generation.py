@@ -0,0 +1,295 @@
+"""
+Measures every stage of generating a composition on fixed inputs and prints
+the timings as JSON, so results can be compared across commits.
+
+Usage: poetry run python -m benchmarks.generation [--repeat 5] [FILE]
+
+Speech recognition runs with a stub recognizer returning synthetic word
+times, this way the benchmark works offline without any Vosk models. Without
+a file a synthetic recording is generated first, otherwise the given WAV
+file (for example one of the bundled samples) is used.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import wave
+from unittest import mock
+
+import click
+import numpy as np
+from loguru import logger
+from sqlalchemy import create_engine, insert
+
+from tinychronicler.constants import (
+    ALIGNMENT,
+    MIDI_MODULES_1,
+    MIDI_MODULES_2,
+    AlignmentEnum,
+)
+from tinychronicler.database import models
+from tinychronicler.database.encoding import (
+    COMPOSITION_VERSION,
+    encode_composition,
+)
+from tinychronicler.generator import GenerationContext, notes, parameters
+from tinychronicler.generator.midi import load_midi_modules
+from tinychronicler.generator.movements import MOVEMENTS
+from tinychronicler.helpers import temporary_file
+
+from .decode import generate_wav
+
+# Fixed seed for synthetic fixtures and random choices during generation
+SEED = 42
+
+# Media files are only referenced by their path in the parameters, they do
+# not need to exist
+IMAGE_FILES = ["image-{}.jpg".format(index) for index in range(8)]
+VIDEO_FILES = ["video-{}.mp4".format(index) for index in range(4)]
+
+# Fixed length of all videos (in seconds), probing them with ffprobe is not
+# part of this benchmark
+VIDEO_DURATION = 30.0
+
+
+def generate_word_times(duration: float, seed=SEED):
+    """
+    Returns synthetic word times resembling speech: phrases of a few words
+    separated by short pauses
+    """
+    rng = np.random.default_rng(seed)
+    word_times = []
+    time_cursor = 0.0
+    while True:
+        for _ in range(rng.integers(3, 12)):
+            length = rng.uniform(0.15, 0.6)
+            if time_cursor + length > duration:
+                return word_times
+            word_times.append((round(time_cursor, 2),
+                               round(time_cursor + length, 2),
+                               round(rng.uniform(0.5, 1.0), 2)))
+            time_cursor += length + rng.uniform(0.02, 0.2)
+        time_cursor += rng.uniform(0.3, 2.0)
+
+
+class StubRecognizer:
+    """
+    Stands in for the Vosk recognizer, returns the given word times as soon
+    as enough audio was fed into it
+    """
+
+    def __init__(self, word_times, sample_rate: int):
+        self.word_times = word_times
+        self.bytes_per_second = sample_rate * 2
+        self.read_bytes = 0
+        self.cursor = 0
+
+    def SetWords(self, enabled: bool):
+        pass
+
+    def AcceptWaveform(self, data: bytes):
+        self.read_bytes += len(data)
+        return True
+
+    def Result(self, final=False):
+        position = self.read_bytes / self.bytes_per_second
+        words = []
+        while (self.cursor < len(self.word_times) and
+                (final or self.word_times[self.cursor][1] <= position)):
+            (start, end, conf) = self.word_times[self.cursor]
+            words.append({
+                "start": start,
+                "end": end,
+                "conf": conf,
+                "word": "word",
+            })
+            self.cursor += 1
+        return json.dumps({"result": words})
+
+    def PartialResult(self):
+        return json.dumps({"partial": ""})
+
+    def FinalResult(self):
+        return self.Result(final=True)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,
+                              check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_once(audio_file: str, word_times, engine, alignment: str):
+    """
+    Generates one composition and returns the duration of every stage
+    """
+    timings = {}
+
+    def measure(stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    context = GenerationContext(SEED)
+    voice_contexts = context.fork(2)
+
+    duration = measure("duration", notes.audio_file_duration, audio_file)
+
+    # Speech recognition with stub recognizer, this measures decoding audio
+    # and handling the results
+    with mock.patch.object(notes.model_registry, "get",
+                           lambda language_code: None), \
+            mock.patch.object(notes, "KaldiRecognizer",
+                              lambda model, sample_rate: StubRecognizer(
+                                  word_times, sample_rate)):
+        detected = measure("asr", notes.detect_word_times, audio_file)
+
+    quantized = measure(
+        "quantize",
+        lambda: notes.WordTimesIndex(
+            notes.quantize_word_times([word[0] for word in detected])))
+
+    map_modules = notes.map_modules_to_word_times
+    if alignment == AlignmentEnum.global_:
+        map_modules = notes.align_modules_to_word_times
+
+    result_notes = []
+    result_module_indices = []
+    for voice, midi_modules in enumerate([MIDI_MODULES_1, MIDI_MODULES_2]):
+        modules = load_midi_modules(midi_modules)
+        analysis = measure("analysis_voice_{}".format(voice + 1),
+                           notes.analyze_voice,
+                           duration,
+                           modules,
+                           quantized)
+        voice_notes, module_indices = measure(
+            "mapping_voice_{}".format(voice + 1),
+            map_modules,
+            duration,
+            analysis,
+            voice_contexts[voice].random)
+        result_notes.append(voice_notes.tolist())
+        result_module_indices.append(module_indices)
+
+    with mock.patch.object(parameters, "get_video_length",
+                           lambda file: VIDEO_DURATION):
+        result_parameters = measure("parameters",
+                                    parameters.generate_parameters,
+                                    result_module_indices,
+                                    MOVEMENTS,
+                                    VIDEO_FILES,
+                                    IMAGE_FILES,
+                                    context)
+
+    data = measure("encode",
+                   encode_composition,
+                   {"notes": result_notes, "parameters": result_parameters})
+
+    def write(data):
+        with engine.begin() as connection:
+            connection.execute(insert(models.Composition).values(
+                chronicle_id=1,
+                data=data,
+                is_ready=True,
+                title="Benchmark",
+                version=COMPOSITION_VERSION,
+                seed=SEED))
+
+    measure("db_write", write, data)
+
+    timings["total"] = sum(timings.values())
+    return timings, {
+        "words": len(detected),
+        "modules": [len(indices) for indices in result_module_indices],
+        "data_size": len(data),
+    }
+
+
+def run(audio_file: str, repeat: int, name: str, alignment: str):
+    with wave.open(audio_file, "rb") as f:
+        duration = f.getnframes() / f.getframerate()
+    word_times = generate_word_times(duration)
+
+    # Analyze MIDI modules once before, they are cached per process
+    load_midi_modules(MIDI_MODULES_1 + MIDI_MODULES_2)
+
+    runs = []
+    with temporary_file(".sqlite3") as database_path:
+        engine = create_engine("sqlite:///{}".format(database_path))
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            connection.execute(insert(models.Chronicle).values(
+                title="Benchmark", description="", language="en"))
+
+        for _ in range(repeat):
+            timings, info = run_once(audio_file,
+                                     word_times,
+                                     engine,
+                                     alignment)
+            runs.append(timings)
+        engine.dispose()
+
+    stages = {}
+    for stage in runs[0].keys():
+        values = [timings[stage] for timings in runs]
+        stages[stage] = {
+            "min": min(values),
+            "median": statistics.median(values),
+            "mean": statistics.mean(values),
+        }
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "file": name,
+        "duration": duration,
+        "repeat": repeat,
+        "alignment": alignment,
+        "fixture": info,
+        "stages": stages,
+    }
+
+
+@click.command()
+@click.option("--duration", type=float, default=180.0, show_default=True,
+              help="Duration of synthetic recording in seconds.")
+@click.option("--repeat", type=int, default=5, show_default=True,
+              help="Number of generations to measure.")
+@click.option("--output", type=click.Path(dir_okay=False),
+              help="Write JSON results to this file instead of stdout.")
+@click.option("--alignment",
+              type=click.Choice([mode.value for mode in AlignmentEnum]),
+              default=ALIGNMENT.value, show_default=True,
+              help="Way to map modules to spoken words.")
+@click.argument("file", required=False)
+def main(duration: float,
+         repeat: int,
+         output: str,
+         alignment: str,
+         file: str):
+    # Logging would dominate the measured mapping times
+    logger.remove()
+
+    if file is not None:
+        results = run(file, repeat, os.path.basename(file), alignment)
+    else:
+        with temporary_file(".wav") as file_path:
+            generate_wav(file_path, duration)
+            results = run(file_path, repeat, "synthetic", alignment)
+
+    if output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Measures the cost of sending OSC messages during a performance, building
+every message and sending it with a blocking UDP client against the cached
+datagrams sent via the asyncio transport.
+
+Usage: poetry run python -m benchmarks.osc [--count 100000]
+
+Messages go to a local socket which never reads them, this way only the
+sending side is measured.
+"""
+import asyncio
+import socket
+import sys
+import time
+
+import click
+from loguru import logger
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.udp_client import UDPClient
+
+from tinychronicler.io import osc
+
+HOST = "127.0.0.1"
+
+# Typical messages of a performance: beats, notes and muting the narrator
+MESSAGES = [("/metronome/beat",), ("/audio/mute",), ("/audio/unmute",)] + [
+    ("/note/{}".format(voice), pitch)
+    for voice in ["human", "robot"] for pitch in range(48, 72)]
+
+
+def receiver():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((HOST, 0))
+    return s
+
+
+def send_built(client: UDPClient, address: str, *args):
+    # How messages were sent before: built every time, with an eagerly
+    # formatted log message
+    builder = OscMessageBuilder(address=address)
+    for arg in args:
+        builder.add_arg(arg)
+    message = builder.build()
+    logger.debug("Send OSC message: {} {}".format(address, args))
+    client.send(message)
+
+
+def measure(name: str, send, count: int):
+    start = time.perf_counter()
+    for index in range(count):
+        send(*MESSAGES[index % len(MESSAGES)])
+    elapsed = time.perf_counter() - start
+    print("{:<8} {:8.3f}s {:8.2f}us/message".format(
+        name, elapsed, elapsed / count * 1000 * 1000))
+
+
+async def run(count: int):
+    with receiver() as s:
+        port = s.getsockname()[1]
+
+        client = UDPClient(HOST, port)
+        measure("built", lambda *args: send_built(client, *args), count)
+
+        osc.osc_output.configure(["{}:{}".format(HOST, port)])
+        await osc.osc_output.start()
+        measure("cached", osc.send_message, count)
+        osc.osc_output.stop()
+
+
+@click.command()
+@click.option("--count", type=int, default=100000, show_default=True,
+              help="Number of messages to send.")
+def main(count: int):
+    # Debug messages are not shown during a performance
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+
+    asyncio.run(run(count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from tinychronicler.generator import notes
+
+# Start times of recognized words (in seconds) of a short spoken sentence
+WORD_TIMES = [
+    0.33, 0.54, 0.69, 1.02, 1.17, 1.5, 1.86, 2.01, 2.43, 2.61, 2.79, 3.3,
+    3.48, 3.66, 3.99, 4.32, 4.44, 4.86, 5.19, 5.37, 5.88, 6.03, 6.21, 6.72,
+    6.9, 7.2, 7.35, 7.83, 8.1, 8.28,
+]
+
+# Note onsets (in seconds) of modules of different lengths, including one
+# module without any notes
+MODULE_ONSETS = [
+    [0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5],
+    [0.0, 0.25, 0.75, 1.0, 1.75, 2.25, 3.0],
+    [0.1, 1.1, 2.1, 3.1],
+    [0.35, 0.7, 1.2, 1.55, 1.9, 2.45, 2.8, 3.35, 3.7],
+    [2.0],
+    [],
+]
+
+MODULE_DURATION = 4.0
+
+
+def reference_similarity(source, target, t=notes.SIMILARITY_THRESHOLD):
+    """
+    Loop implementation the vectorized similarity replaced
+    """
+    if len(target) == 0 and len(source) == 0:
+        return 1
+    deltas = np.array([])
+    for src_event in source:
+        values = [abs(src_event - trg_event) for trg_event in target]
+        deltas = np.append(deltas,
+                           [(t - v) / t for v in values if v < t])
+    result = np.median(deltas) if len(deltas) > 0 else 0.0
+    return result
+
+
+def windows():
+    index = notes.WordTimesIndex(WORD_TIMES)
+    offsets = np.arange(0, WORD_TIMES[-1], 0.25)
+    return [(offset, index.window(offset, offset + MODULE_DURATION))
+            for offset in offsets]
+
+
+def test_calculate_similarity_matches_reference():
+    for (offset, source) in windows():
+        for onsets in MODULE_ONSETS:
+            target = np.asarray(onsets) + offset
+            assert notes.calculate_similarity(source, target) == \
+                pytest.approx(reference_similarity(source, target))
+
+
+def test_calculate_similarities_matches_reference():
+    onsets = notes.module_onsets(
+        [{"onsets": onsets} for onsets in MODULE_ONSETS])
+    for (offset, source) in windows():
+        expected = [reference_similarity(source, np.asarray(target) + offset)
+                    for target in MODULE_ONSETS]
+        assert notes.calculate_similarities(source, onsets + offset) == \
+            pytest.approx(expected)
+
+
+def test_similarity_matrix_matches_reference():
+    index = notes.WordTimesIndex(WORD_TIMES)
+    onsets = notes.module_onsets(
+        [{"onsets": onsets} for onsets in MODULE_ONSETS])
+    offsets = np.arange(0, WORD_TIMES[-1], 0.25)
+    results = notes.similarity_matrix(index, onsets, offsets,
+                                      MODULE_DURATION)
+    for (row, offset) in enumerate(offsets):
+        source = index.window(offset, offset + MODULE_DURATION)
+        expected = [reference_similarity(source, np.asarray(target) + offset)
+                    for target in MODULE_ONSETS]
+        assert results[row] == pytest.approx(expected)
+
+
+def test_empty_source_and_target():
+    assert notes.calculate_similarity([], []) == 1
+    assert reference_similarity([], []) == 1
+
+
+def test_empty_source_or_target():
+    assert notes.calculate_similarity([], [0.5, 1.0]) == 0
+    assert notes.calculate_similarity([0.5, 1.0], []) == 0
+    assert reference_similarity([], [0.5, 1.0]) == 0
+    assert reference_similarity([0.5, 1.0], []) == 0
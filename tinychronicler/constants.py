@@ -56,6 +56,10 @@ UPLOADS_DIR = "uploads"
 # Path to musical "modules" directory
 MIDI_MODULES_DIR = "midi"
 
+# Path to compiled bank of all analyzed musical modules, it gets rebuilt
+# whenever one of the MIDI files changes
+MIDI_BANK_PATH = "midi/bank.npz"
+
 # Paths to trained machine learning model for speech recognition
 MODEL_PATHS = {
     "ar": "models/vosk-model-ar-mgb2-0.4",
@@ -70,6 +74,37 @@ MODEL_PATHS = {
     "ru": "models/vosk-model-small-ru-0.22",
 }
 
+# Maximum memory (in bytes) loaded speech recognition models may occupy before
+# the least recently used ones get evicted
+MODEL_MEMORY_BUDGET = 512 * 1000 * 1000  # 512MB
+
+# Number of processes generating compositions in parallel
+COMPOSITION_WORKERS = 1
+
+# Maximum number of compositions waiting to be generated
+COMPOSITION_QUEUE_SIZE = 8
+
+# Maximum number of variants which can be requested at once
+COMPOSITION_BATCH_SIZE = 16
+
+# Start speech recognition right after an audio file got uploaded
+TRANSCRIBE_ON_UPLOAD = True
+
+# Number of processes detecting word times of one audio file in parallel
+ASR_WORKERS = 1
+
+# Long audio files are split into segments of about this duration (in seconds)
+# which are transcribed in parallel
+ASR_SEGMENT_DURATION = 120.0
+
+# Receivers of OSC messages as "host:port", optionally followed by a look
+# ahead and the address prefixes a receiver is limited to, for example:
+# "192.168.1.20:9000@0.1/video,/image". Receivers with a look ahead get
+# messages of a performance this many seconds early, as bundles with a
+# timetag they schedule them by. Only use it for receivers which respect
+# timetags, the Pd patch does not
+OSC_TARGETS = ["127.0.0.1:51230"]
+
 
 class LanguageEnum(str, Enum):
     # Enum of possible language selections
@@ -85,6 +120,15 @@ class LanguageEnum(str, Enum):
     russian = "ru"
 
 
+class AlignmentEnum(str, Enum):
+    # Enum of possible ways to map modules to spoken words
+    greedy = "greedy"  # Pick best module slice by slice
+    global_ = "global"  # Pick best sequence of modules over the whole file
+
+
+# Default way to map modules to spoken words
+ALIGNMENT = AlignmentEnum.greedy
+
 # Grid size of the composition (in seconds)
 GRID_SIZE = 0.0625  # 32th note in 120bpm (quarters)
 
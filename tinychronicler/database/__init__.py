@@ -1,4 +1,5 @@
 from . import models, schemas
 from .database import Base, database, engine
+from .migrations import migrate
 
-__all__ = ["database", "engine", "Base", "models", "schemas"]
+__all__ = ["database", "engine", "Base", "models", "schemas", "migrate"]
@@ -0,0 +1,199 @@
+import json
+import math
+import pickle
+import struct
+
+import numpy as np
+
+# Versions of the format composition data is stored in:
+#
+# 1: Pickled Python objects
+# 2: Binary format with typed arrays, times as float32
+# 3: Binary format with typed arrays, times as float64 (see
+#    encode_composition)
+PICKLE_VERSION = 1
+FLOAT32_VERSION = 2
+BINARY_VERSION = 3
+
+# Compositions are always stored in the latest version
+COMPOSITION_VERSION = BINARY_VERSION
+
+# Magic, number of voices, modules, parameter indices and size of the string
+# table (in bytes)
+HEADER = struct.Struct("<4sHIII")
+
+
+def note_dtype(time_type: str):
+    return np.dtype([
+        ("pitch", "i1"),
+        ("start", time_type),
+        ("end", time_type),
+    ])
+
+
+def module_dtype(time_type: str):
+    return np.dtype([
+        ("id_1", "<u2"),
+        ("id_2", "<u2"),
+        ("start", time_type),
+        ("end", time_type),
+        ("media", "<i4"),  # Index in string table, -1 when not given
+        ("media_from", time_type),  # NaN when not given
+        ("parameters_offset", "<u4"),
+        ("parameters_count", "<u2"),
+    ])
+
+
+# Magic and types of notes and modules of every binary version. Times are
+# stored as float64, float32 lost sub-millisecond precision after a few hours
+BINARY_FORMATS = {
+    FLOAT32_VERSION: (b"TCC2", note_dtype("<f4"), module_dtype("<f4")),
+    BINARY_VERSION: (b"TCC3", note_dtype("<f8"), module_dtype("<f8")),
+}
+
+PARAMETER_DTYPE = np.dtype("<u2")  # Index in string table
+
+
+def encode_composition(data):
+    """
+    Encodes generated composition data into a compact binary format. Notes
+    of every voice are stored as typed arrays, parameters of every module as
+    one table referring to a list of strings (parameter names and media)
+    """
+    (magic, note_type, module_type) = BINARY_FORMATS[BINARY_VERSION]
+    strings = []
+    string_indices = {}
+
+    def string_index(value: str):
+        if value not in string_indices:
+            string_indices[value] = len(strings)
+            strings.append(value)
+        return string_indices[value]
+
+    voices = []
+    for notes in data["notes"]:
+        voice = np.zeros(len(notes), dtype=note_type)
+        if len(notes) > 0:
+            values = np.asarray(notes, dtype=float).reshape(-1, 3)
+            voice["pitch"] = values[:, 0]
+            voice["start"] = values[:, 1]
+            voice["end"] = values[:, 2]
+        voices.append(voice)
+
+    modules = np.zeros(len(data["parameters"]), dtype=module_type)
+    parameter_indices = []
+    for index, module in enumerate(data["parameters"]):
+        (id_1, id_2, start, end) = module["module"]
+        media = module.get("media")
+        media_from = module.get("media_from")
+        modules[index] = (
+            id_1,
+            id_2,
+            start,
+            end,
+            string_index(media) if media is not None else -1,
+            media_from if media_from is not None else math.nan,
+            len(parameter_indices),
+            len(module["parameters"]),
+        )
+        for parameter in module["parameters"]:
+            parameter_indices.append(string_index(parameter))
+
+    string_table = json.dumps(strings).encode("utf-8")
+    header = HEADER.pack(magic,
+                         len(voices),
+                         len(modules),
+                         len(parameter_indices),
+                         len(string_table))
+    counts = struct.pack("<{}I".format(len(voices)),
+                         *[len(voice) for voice in voices])
+
+    return b"".join([
+        header,
+        counts,
+        *[voice.tobytes() for voice in voices],
+        modules.tobytes(),
+        np.asarray(parameter_indices, dtype=PARAMETER_DTYPE).tobytes(),
+        string_table,
+    ])
+
+
+def decode_composition(blob: bytes, version: int = COMPOSITION_VERSION):
+    """
+    Decodes stored composition data. Notes are returned as NumPy arrays
+    pointing into the given buffer, without copying them
+    """
+    if version == PICKLE_VERSION:
+        return pickle.loads(blob)
+    if version not in BINARY_FORMATS:
+        raise Exception("Unknown composition version {}".format(version))
+    (expected_magic, note_type, module_type) = BINARY_FORMATS[version]
+
+    buffer = memoryview(blob)
+    (magic, voices_count, modules_count, parameters_count,
+     strings_size) = HEADER.unpack_from(buffer)
+    if magic != expected_magic:
+        raise Exception("Invalid composition data")
+    offset = HEADER.size
+
+    counts = struct.unpack_from("<{}I".format(voices_count), buffer, offset)
+    offset += 4 * voices_count
+
+    def read(dtype, count):
+        nonlocal offset
+        values = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        offset += dtype.itemsize * count
+        return values
+
+    notes = [read(note_type, count) for count in counts]
+    modules = read(module_type, modules_count)
+    parameter_indices = read(PARAMETER_DTYPE, parameters_count).tolist()
+    strings = json.loads(bytes(buffer[offset:offset + strings_size]))
+
+    parameters = []
+    for module in modules.tolist():
+        (id_1, id_2, start, end, media, media_from, parameters_offset,
+         parameters_count) = module
+        parameters.append({
+            "parameters": [
+                strings[index] for index in parameter_indices[
+                    parameters_offset:parameters_offset + parameters_count]
+            ],
+            "module": (id_1, id_2, start, end),
+            "media": strings[media] if media >= 0 else None,
+            "media_from": None if math.isnan(media_from) else media_from,
+        })
+
+    return {
+        "notes": notes,
+        "parameters": parameters,
+    }
+
+
+def notes_to_list(notes):
+    """
+    Converts decoded notes of one voice to a list of (pitch, start, end)
+    tuples, float32 times of older versions are rounded to hide their
+    precision
+    """
+    if not isinstance(notes, np.ndarray):
+        return notes
+    if notes.dtype["start"].itemsize < 8:
+        return [(pitch, round(start, 6), round(end, 6))
+                for (pitch, start, end) in notes.tolist()]
+    return notes.tolist()
+
+
+def summarize_composition(data):
+    """
+    Returns statistics of composition data: number of modules, total
+    duration (in seconds) and number of different media files shown
+    """
+    modules = data["parameters"]
+    media = set(module.get("media") for module in modules)
+    media.discard(None)
+    return {
+        "module_count": len(modules),
+        "duration": float(modules[-1]["module"][3]) if modules else 0.0,
+        "media_count": len(media),
+    }
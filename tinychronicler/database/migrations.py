@@ -0,0 +1,80 @@
+from loguru import logger
+from sqlalchemy import inspect, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn
+
+from . import models
+from .database import Base
+from .encoding import (
+    COMPOSITION_VERSION,
+    PICKLE_VERSION,
+    decode_composition,
+    encode_composition,
+    summarize_composition,
+)
+
+
+def add_missing_columns(engine: Engine):
+    """
+    Adds columns which were introduced after a table got created. Only
+    nullable columns or ones with a default value can be added this way
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = [column["name"] for column in
+                    inspector.get_columns(table.name)]
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            definition = CreateColumn(column).compile(dialect=engine.dialect)
+            engine.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                table.name, definition))
+            logger.info("Added column {} to table {}".format(
+                column.name, table.name))
+
+
+def convert_compositions(engine: Engine):
+    """
+    Converts data of compositions stored in an older format to the latest
+    one
+    """
+    compositions = models.Composition.__table__
+    query = select([compositions.c.id, compositions.c.data]).where(
+        (compositions.c.version == PICKLE_VERSION) &
+        (compositions.c.data.isnot(None)))
+    for (composition_id, data) in engine.execute(query).fetchall():
+        data = encode_composition(decode_composition(data, PICKLE_VERSION))
+        engine.execute(update(compositions)
+                       .where(compositions.c.id == composition_id)
+                       .values(data=data, version=COMPOSITION_VERSION))
+        logger.info("Converted data of composition {} to version {}".format(
+            composition_id, COMPOSITION_VERSION))
+
+
+def summarize_compositions(engine: Engine):
+    """
+    Calculates statistics of compositions which were generated before they
+    got stored
+    """
+    compositions = models.Composition.__table__
+    query = select([compositions.c.id,
+                    compositions.c.data,
+                    compositions.c.version]).where(
+        (compositions.c.module_count.is_(None)) &
+        (compositions.c.data.isnot(None)))
+    for (composition_id, data, version) in engine.execute(query).fetchall():
+        stats = summarize_composition(decode_composition(data, version))
+        engine.execute(update(compositions)
+                       .where(compositions.c.id == composition_id)
+                       .values(**stats))
+
+
+def migrate(engine: Engine):
+    """
+    Creates all tables, adds columns missing in existing ones and converts
+    stored data to the latest format
+    """
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    convert_compositions(engine)
+    summarize_compositions(engine)
@@ -2,6 +2,7 @@ from sqlalchemy import (
     Boolean,
     Column,
     DateTime,
+    Float,
     ForeignKey,
     Integer,
     LargeBinary,
@@ -44,6 +45,22 @@ class File(Base):
     chronicle_id = Column(Integer, ForeignKey("chronicles.id"), nullable=False)
 
     chronicle = relationship("chronicle", back_populates="files")
+    transcripts = relationship("Transcript", back_populates="file")
+
+
+class Transcript(Base):
+    __tablename__ = "transcripts"
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    content_hash = Column(String(64), nullable=False, index=True)
+    language = Column(String(2), nullable=False)
+    model = Column(String(128), nullable=False)
+    words = Column(Text, nullable=False)  # JSON list of (start, end, conf)
+    file_id = Column(Integer, ForeignKey("files.id"), nullable=False)
+
+    file = relationship("File", back_populates="transcripts")
 
 
 class Composition(Base):
@@ -57,5 +74,13 @@ class Composition(Base):
     data = Column(LargeBinary)
     chronicle_id = Column(Integer, ForeignKey("chronicles.id"), nullable=False)
     version = Column(Integer, nullable=False)
+    seed = Column(Integer)
+    alignment = Column(String(16))  # Not set for older compositions
+    score = Column(Text)  # Rendered text score, set when data is ready
+
+    # Statistics of the data, set when it is ready
+    module_count = Column(Integer)
+    duration = Column(Float)  # seconds
+    media_count = Column(Integer)
 
     chronicle = relationship("chronicle", back_populates="compositions")
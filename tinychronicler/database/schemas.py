@@ -1,9 +1,9 @@
 from datetime import datetime
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from pydantic import BaseModel, Field
 
-from tinychronicler.constants import LanguageEnum
+from tinychronicler.constants import AlignmentEnum, LanguageEnum
 
 
 class ChronicleBase(BaseModel):
@@ -61,14 +61,35 @@ class FileOut(FileBase, BaseModel):
     created_at: datetime
 
 
+class TranscriptIn(BaseModel):
+    content_hash: str
+    language: LanguageEnum = Field(..., min_length=2, max_length=2)
+    model: str
+    words: List[Tuple[float, float, float]]  # (start, end, confidence)
+
+
+class TranscriptStatusOut(BaseModel):
+    status: str  # "none", "pending", "running", "ready" or "failed"
+    progress: float
+
+
 class CompositionBase(BaseModel):
     is_ready: bool
     title: str
     version: int
+    seed: Optional[int] = None
+    alignment: Optional[AlignmentEnum] = None
 
 
-class CompositionIn(CompositionBase, BaseModel):
+class CompositionStats(BaseModel):
+    module_count: Optional[int] = None
+    duration: Optional[float] = None
+    media_count: Optional[int] = None
+
+
+class CompositionIn(CompositionBase, CompositionStats, BaseModel):
     data: Optional[bytes] = None
+    score: Optional[str] = None
 
 
 class Composition(CompositionBase, BaseModel):
@@ -84,6 +105,11 @@ class CompositionOut(CompositionBase, BaseModel):
     id: int
 
 
+class CompositionSummaryOut(CompositionBase, CompositionStats, BaseModel):
+    created_at: datetime
+    id: int
+
+
 class CompositionDataParameters(BaseModel):
     parameters: List[str]
     module: Tuple[int, int, float, float]  # (id 1, id 2, start, end)
@@ -109,3 +135,35 @@ class IOTest(BaseModel):
 
 class PlayerConfiguration(BaseModel):
     is_demo: bool
+
+
+class ModelRegistryStats(BaseModel):
+    loaded: List[str]
+    memory_used: int  # in bytes
+    memory_budget: int  # in bytes
+    hits: int
+    misses: int
+    evictions: int
+    load_times: Dict[str, float]  # in seconds
+
+
+class ModelStats(ModelRegistryStats):
+    # Usage of all processes added up, the memory budget applies to every
+    # process on its own
+    workers: Dict[int, ModelRegistryStats]  # by process id
+
+
+class OscTargetStats(BaseModel):
+    host: str
+    port: int
+    addresses: Optional[List[str]]  # Address prefixes, all when not given
+    look_ahead: float  # in seconds, 0 when timetags are not supported
+    is_connected: bool
+    sent: int
+    dropped: int
+    errors: int
+    queued: int
+
+
+class OscStats(BaseModel):
+    targets: List[OscTargetStats]
@@ -1,3 +1,8 @@
-from .generator import generate_composition
+from .context import GenerationContext, new_seed
+from .generator import generate_composition, generate_compositions
+from .notes import detect_word_times, detect_word_times_parallel
+from .recognizer import model_registry, model_version
 
-__all__ = ["generate_composition"]
+__all__ = ["generate_composition", "generate_compositions",
+           "detect_word_times", "detect_word_times_parallel",
+           "model_registry", "model_version", "GenerationContext", "new_seed"]
@@ -0,0 +1,31 @@
+import random
+from typing import Optional
+
+import numpy as np
+
+
+def new_seed():
+    """
+    Returns a random seed which fits into an integer column
+    """
+    return random.SystemRandom().randrange(2 ** 31)
+
+
+class GenerationContext:
+    """
+    Holds the random generators of one generation. Compositions generated
+    with the same seed and inputs are always the same.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = seed if seed is not None else new_seed()
+        self.random = random.Random(self.seed)
+        self.numpy = np.random.default_rng(self.seed)
+
+    def fork(self, count: int):
+        """
+        Returns independent contexts for parts of the generation which run
+        in parallel, they are derived from this context's seed
+        """
+        seeds = self.random.sample(range(2 ** 31), count)
+        return [GenerationContext(seed) for seed in seeds]
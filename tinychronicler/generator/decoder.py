@@ -0,0 +1,264 @@
+import contextlib
+import subprocess
+import wave
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+# Number of filter coefficients of the low-pass filter applied before
+# resampling, higher values remove more aliasing but are slower
+RESAMPLE_TAPS = 101
+
+# Sample widths (in bytes) of WAV files we can read ourselves
+SAMPLE_FORMATS = {
+    1: np.uint8,
+    2: np.dtype("<i2"),
+    4: np.dtype("<i4"),
+}
+
+
+class Resampler:
+    """
+    Converts mono audio to another sample rate block by block. The signal is
+    low-pass filtered first to avoid aliasing and then linearly interpolated
+    at the new sample positions.
+    """
+
+    def __init__(self, rate_in: int, rate_out: int, taps=RESAMPLE_TAPS):
+        # Position step in input samples per output sample
+        self.step = rate_in / rate_out
+
+        # Windowed-sinc low-pass filter a little below the new Nyquist
+        # frequency, normalized to keep the volume
+        cutoff = 0.48 * min(1.0, rate_out / rate_in)
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(taps)
+        self.kernel = (kernel / kernel.sum()).astype(np.float32)
+        self.delay = (taps - 1) // 2
+
+        # Input samples needed to filter the next block, we start with
+        # silence
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.consumed = 0  # Number of input samples so far
+
+        # Filtered samples not interpolated yet and their global position
+        self.filtered = np.zeros(0, dtype=np.float32)
+        self.filtered_start = -self.delay
+
+        # Index of next output sample
+        self.position = 0
+
+    def process(self, samples: np.ndarray):
+        """
+        Takes the next block of input samples and returns all output samples
+        which can be calculated from them
+        """
+        self.filter(samples)
+        return self.interpolate()
+
+    def flush(self):
+        """
+        Returns the remaining output samples after the last block was given
+        """
+        total = self.consumed
+        self.filter(np.zeros(self.delay + 1, dtype=np.float32))
+        return self.interpolate(limit=total)
+
+    def filter(self, samples: np.ndarray):
+        buffer = np.concatenate([self.history, samples])
+        self.history = buffer[len(buffer) - len(self.history):]
+        self.consumed += len(samples)
+        filtered = np.convolve(buffer, self.kernel, mode="valid")
+        self.filtered = np.concatenate([self.filtered, filtered])
+
+    def interpolate(self, limit=None):
+        # Last global input position we can interpolate at
+        end = self.filtered_start + len(self.filtered) - 1
+        if limit is not None:
+            end = min(end, limit - 1)
+        if end < self.position * self.step:
+            return np.zeros(0)
+
+        last = int(np.floor(end / self.step))
+        positions = np.arange(self.position, last + 1) * self.step
+        results = np.interp(
+            positions,
+            np.arange(len(self.filtered)) + self.filtered_start,
+            self.filtered)
+
+        # Forget everything we do not need for the next output samples
+        self.position = last + 1
+        keep_from = min(int(np.floor(self.position * self.step)),
+                        self.filtered_start + len(self.filtered))
+        self.filtered = self.filtered[keep_from - self.filtered_start:]
+        self.filtered_start = keep_from
+        return results
+
+
+def to_mono(data: bytes, dtype: np.dtype, channels: int):
+    """
+    Converts raw interleaved frames to mono float samples in 16bit range
+    """
+    frames = np.frombuffer(data, dtype=dtype).reshape(-1, channels)
+
+    # Downmix to mono by adding up channels one by one, this is much faster
+    # than calculating the mean over the axis
+    samples = frames[:, 0].astype(np.float32)
+    for channel in range(1, channels):
+        samples += frames[:, channel]
+    samples /= channels
+
+    # Convert to 16bit range
+    if dtype == np.uint8:
+        samples = (samples - 128) * 256
+    elif dtype == SAMPLE_FORMATS[4]:
+        samples = samples / 65536
+    return samples
+
+
+def to_pcm(samples: np.ndarray):
+    """
+    Converts float samples to 16bit PCM bytes
+    """
+    return np.clip(np.round(samples), -32768, 32767).astype("<i2").tobytes()
+
+
+def open_wav(audio_file: str):
+    """
+    Opens WAV file for reading, fails when we can not read its samples
+    """
+    f = wave.open(audio_file, "rb")
+    if f.getsampwidth() not in SAMPLE_FORMATS or f.getcomptype() != "NONE":
+        f.close()
+        raise wave.Error("Unsupported WAV sample format")
+    return f
+
+
+def probe_duration(audio_file: str):
+    """
+    Asks ffprobe for the duration (in seconds) of any audio file, returns
+    None when it is not known
+    """
+    args = ["ffprobe", "-loglevel", "quiet",
+            "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1",
+            audio_file]
+    try:
+        result = subprocess.run(args, capture_output=True, check=True,
+                                text=True)
+        return float(result.stdout)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        logger.debug("Could not probe duration of {}".format(audio_file))
+        return None
+
+
+def audio_duration(audio_file: str):
+    """
+    Returns duration of an audio file (in seconds). WAV files are measured by
+    their header, everything else with ffprobe. Returns None when it is not
+    known
+    """
+    try:
+        with contextlib.closing(wave.open(audio_file, "rb")) as f:
+            return f.getnframes() / float(f.getframerate())
+    except (wave.Error, EOFError):
+        return probe_duration(audio_file)
+
+
+def read_wav(audio_file: str,
+             sample_rate: int,
+             buffer_size: int,
+             start: float = 0.0,
+             end: Optional[float] = None):
+    """
+    Reads WAV file and yields it as mono 16bit PCM in the given sample rate,
+    buffer size is given in bytes of the converted audio. Optionally only
+    the part between start and end (in seconds) is read
+    """
+    with contextlib.closing(open_wav(audio_file)) as f:
+        channels = f.getnchannels()
+        rate_in = f.getframerate()
+        dtype = SAMPLE_FORMATS[f.getsampwidth()]
+
+        # Jump to the requested part of the file
+        start_frame = min(int(start * rate_in), f.getnframes())
+        end_frame = f.getnframes()
+        if end is not None:
+            end_frame = min(int(end * rate_in), end_frame)
+        f.setpos(start_frame)
+        remaining = end_frame - start_frame
+
+        # Read as many input frames as we need for one output buffer
+        frames_per_block = max(
+            int(buffer_size / 2 * rate_in / sample_rate), 1)
+        resampler = None
+        if rate_in != sample_rate:
+            resampler = Resampler(rate_in, sample_rate)
+
+        while remaining > 0:
+            data = f.readframes(min(frames_per_block, remaining))
+            if len(data) == 0:
+                break
+            samples = to_mono(data, dtype, channels)
+            remaining -= len(samples)
+
+            if resampler is not None:
+                samples = resampler.process(samples)
+            if len(samples) > 0:
+                yield to_pcm(samples)
+
+        if resampler is not None:
+            samples = resampler.flush()
+            if len(samples) > 0:
+                yield to_pcm(samples)
+
+
+def read_ffmpeg(audio_file: str,
+                sample_rate: int,
+                buffer_size: int,
+                start: float = 0.0,
+                end: Optional[float] = None):
+    """
+    Converts any audio file with ffmpeg and yields it as mono 16bit PCM in
+    the given sample rate. Optionally only the part between start and end (in
+    seconds) is converted
+    """
+    args = ["ffmpeg", "-loglevel", "quiet", "-ss", str(start)]
+    if end is not None:
+        args += ["-t", str(end - start)]
+    args += ["-i", audio_file,
+             "-ar", str(sample_rate),
+             "-ac", "1",
+             "-f", "s16le",
+             "-"]
+    with subprocess.Popen(args, stdout=subprocess.PIPE) as process:
+        while True:
+            data = process.stdout.read(buffer_size)
+            if len(data) == 0:
+                break
+            yield data
+
+
+def decode_audio(audio_file: str,
+                 sample_rate: int,
+                 buffer_size: int,
+                 start: float = 0.0,
+                 end: Optional[float] = None):
+    """
+    Yields audio as mono 16bit PCM in the given sample rate. WAV files are
+    read directly, everything else is converted with ffmpeg
+    """
+    try:
+        # Check format first to not fall back in the middle of the file
+        open_wav(audio_file).close()
+        supported = True
+    except (wave.Error, EOFError):
+        supported = False
+
+    if supported:
+        yield from read_wav(audio_file, sample_rate, buffer_size, start, end)
+    else:
+        logger.debug("Convert {} with ffmpeg".format(audio_file))
+        yield from read_ffmpeg(audio_file, sample_rate, buffer_size,
+                               start, end)
@@ -1,24 +1,37 @@
 import os
-from typing import List
+from typing import List, Optional, Tuple
 
 from tinychronicler.constants import (
+    ALIGNMENT,
     ALLOWED_MIME_TYPES_AUDIO,
     ALLOWED_MIME_TYPES_IMAGE,
     ALLOWED_MIME_TYPES_VIDEO,
 )
 from tinychronicler.database import schemas
 
+from .context import GenerationContext
 from .movements import (
     MOVEMENTS,
     MOVEMENTS_WITHOUT_PHOTO,
     MOVEMENTS_WITHOUT_VIDEO,
     MOVEMENTS_WITHOUT_VIDEO_AND_PHOTO,
 )
-from .notes import generate_notes
+from .notes import Analysis, analyze_recording, generate_notes
 from .parameters import generate_parameters
 
 
-def generate_composition(files: List[schemas.File], language: str):
+def generate_composition(
+    files: List[schemas.File],
+    language: str,
+    word_times: Optional[List[Tuple[float, float, float]]] = None,
+    alignment: str = ALIGNMENT,
+    seed: Optional[int] = None,
+    analysis: Optional[Analysis] = None,
+):
+    # All random decisions are derived from the seed, the same seed always
+    # leads to the same composition
+    context = GenerationContext(seed)
+
     # Separate media files by type
     audio_files = [f.path for f in files if f.mime in ALLOWED_MIME_TYPES_AUDIO]
     video_files = [f.path for f in files if f.mime in ALLOWED_MIME_TYPES_VIDEO]
@@ -31,8 +44,14 @@ def generate_composition(files: List[schemas.File], language: str):
     assert os.path.exists(audio_file)
 
     # Generate a MIDI score and list of modules from audio file. A module is a
-    # predetermined short sequence of notes
-    (notes, module_indices) = generate_notes(audio_file, language)
+    # predetermined short sequence of notes. Speech recognition is skipped
+    # when the word times of this file are already given, analyzing the file
+    # when that was already done for another variant
+    if analysis is None:
+        analysis = analyze_recording(audio_file, language, word_times)
+    (notes, module_indices) = generate_notes(analysis,
+                                             alignment=alignment,
+                                             context=context)
 
     # Generate parameters which determine the used sounds and media of the
     # composition
@@ -46,9 +65,34 @@ def generate_composition(files: List[schemas.File], language: str):
     elif not has_images and not has_videos:
         movements = MOVEMENTS_WITHOUT_VIDEO_AND_PHOTO
     parameters = generate_parameters(
-        module_indices, movements, video_files, image_files)
+        module_indices, movements, video_files, image_files, context)
 
     return {
         "notes": notes,
         "parameters": parameters,
     }
+
+
+def generate_compositions(
+    files: List[schemas.File],
+    language: str,
+    seeds: List[int],
+    word_times: Optional[List[Tuple[float, float, float]]] = None,
+    alignment: str = ALIGNMENT,
+):
+    """
+    Generates one composition per seed. The recording gets analyzed only
+    once, all variants share the word times and module similarities and only
+    differ in the choices depending on their seed
+    """
+    audio_file = next(f.path for f in files
+                      if f.mime in ALLOWED_MIME_TYPES_AUDIO)
+    analysis = analyze_recording(audio_file, language, word_times)
+
+    return [generate_composition(files,
+                                 language,
+                                 word_times,
+                                 alignment,
+                                 seed,
+                                 analysis)
+            for seed in seeds]
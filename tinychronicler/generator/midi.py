@@ -1,9 +1,22 @@
+import hashlib
 import os
+import tempfile
+import zipfile
+from functools import lru_cache
 
 import numpy as np
 import pretty_midi
+from loguru import logger
 
-from tinychronicler.constants import MIDI_MODULES_DIR
+from tinychronicler.constants import (
+    MIDI_BANK_PATH,
+    MIDI_MODULES_1,
+    MIDI_MODULES_2,
+    MIDI_MODULES_DIR,
+)
+
+# Banks of other versions are compiled again
+BANK_VERSION = 2
 
 
 def get_midi_files(base_dir):
@@ -43,15 +56,135 @@ def analyze_midi(file, bpm=120):
     return get_all_notes(score)
 
 
+def midi_module_entry(notes):
+    """
+    Returns notes and note onsets of a MIDI module, modules without any
+    notes have empty arrays
+    """
+    notes = notes.reshape(-1, 3)
+    return {
+        "notes": notes,
+        "onsets": notes[:, 1],
+    }
+
+
+def midi_files_fingerprint(files):
+    """
+    Returns a hash over names, modification times and sizes of all given
+    MIDI files to detect if any of them changed
+    """
+    fingerprint = hashlib.sha1()
+    for file in files:
+        stat = os.stat("{}/{}".format(MIDI_MODULES_DIR, file))
+        fingerprint.update("{}:{}:{};".format(
+            file, stat.st_mtime_ns, stat.st_size).encode("utf-8"))
+    return fingerprint.hexdigest()
+
+
+def compile_midi_bank(files, fingerprint, bank_path=MIDI_BANK_PATH):
+    """
+    Analyze all given MIDI files and store their notes and note onsets in
+    one bank file
+    """
+    bank = {}
+    for file in files:
+        bank[file] = midi_module_entry(
+            analyze_midi("{}/{}".format(MIDI_MODULES_DIR, file)))
+
+    # Notes and onsets of all files are concatenated, offsets mark where
+    # each file begins and ends
+    lengths = [len(bank[file]["notes"]) for file in files]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    notes = np.concatenate([bank[file]["notes"] for file in files])
+    onsets = np.concatenate([bank[file]["onsets"] for file in files])
+
+    # Write to a temporary file of this process first to not leave a broken
+    # bank behind, other processes might compile the bank at the same time
+    tmp_path = None
+    try:
+        (fd, tmp_path) = tempfile.mkstemp(
+            dir=os.path.dirname(bank_path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f,
+                     version=np.array(BANK_VERSION),
+                     fingerprint=np.array(fingerprint),
+                     files=np.array(files),
+                     offsets=offsets,
+                     notes=notes,
+                     onsets=onsets)
+        os.replace(tmp_path, bank_path)
+        logger.info("Compiled {} MIDI modules into {}"
+                    .format(len(files), bank_path))
+    except OSError as err:
+        logger.warning("Could not write MIDI bank: {}".format(err))
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return bank
+
+
+def read_midi_bank(files, fingerprint, bank_path=MIDI_BANK_PATH):
+    """
+    Read notes and note onsets of all MIDI files from bank file, returns
+    None when it does not exist, is outdated or broken
+    """
+    if not os.path.exists(bank_path):
+        return None
+
+    try:
+        with np.load(bank_path) as data:
+            if ("version" not in data or
+                    int(data["version"]) != BANK_VERSION or
+                    str(data["fingerprint"]) != fingerprint or
+                    data["files"].tolist() != files):
+                return None
+            offsets = data["offsets"]
+            notes = data["notes"]
+            onsets = data["onsets"]
+    except (OSError, EOFError, ValueError, KeyError,
+            zipfile.BadZipFile) as err:
+        logger.warning("Could not read MIDI bank, compile it again: {}"
+                       .format(err))
+        return None
+
+    bank = {}
+    for index, file in enumerate(files):
+        (start, end) = (offsets[index], offsets[index + 1])
+        bank[file] = {
+            "notes": notes[start:end],
+            "onsets": onsets[start:end],
+        }
+    return bank
+
+
+@lru_cache(maxsize=None)
+def load_midi_bank():
+    """
+    Returns notes and note onsets of all known MIDI modules. They are loaded
+    only once per process and analyzed only when the MIDI files changed
+    """
+    files = [module["file"] for module in MIDI_MODULES_1 + MIDI_MODULES_2]
+    fingerprint = midi_files_fingerprint(files)
+    bank = read_midi_bank(files, fingerprint)
+    if bank is None:
+        bank = compile_midi_bank(files, fingerprint)
+    return bank
+
+
 def load_midi_modules(midi_files):
     """
     Load all MIDI files from a list
     """
+    bank = load_midi_bank()
     modules = []
     for file in midi_files:
-        notes = analyze_midi("{}/{}".format(MIDI_MODULES_DIR, file["file"]))
+        if file["file"] in bank:
+            entry = bank[file["file"]]
+        else:
+            entry = midi_module_entry(analyze_midi(
+                "{}/{}".format(MIDI_MODULES_DIR, file["file"])))
         modules.append({
-            "notes": notes,
+            **entry,
             "file": file["file"],
             "duration": file["duration"],
         })
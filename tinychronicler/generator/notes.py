@@ -1,23 +1,29 @@
-import contextlib
 import json
+import math
 import random
-import subprocess
-import wave
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 from loguru import logger
-from vosk import KaldiRecognizer, Model, SetLogLevel
+from vosk import KaldiRecognizer, SetLogLevel
 
 from tinychronicler.constants import (
+    ALIGNMENT,
+    ASR_SEGMENT_DURATION,
+    ASR_WORKERS,
     GRID_SIZE,
     MIDI_MODULES_1,
     MIDI_MODULES_2,
-    MODEL_PATHS,
     MODULE_DURATION,
+    AlignmentEnum,
 )
 
+from .context import GenerationContext
+from .decoder import audio_duration, decode_audio
 from .midi import load_midi_modules
+from .recognizer import model_registry
+from .segments import merge_word_times, plan_segments
 
 SetLogLevel(-1)  # Disable vosk logging
 
@@ -27,46 +33,139 @@ SIMILARITY_THRESHOLD = 0.2
 # Load files with this sample rate
 SAMPLE_RATE = 16000
 
-# Buffer size to load audio file in batches
-BUFFER_SIZE = 4000
+# Buffer size to load audio file in batches (in bytes, 32000 bytes are one
+# second of 16khz, 16bit audio)
+BUFFER_SIZE = 32000
 
 # Allow silence of this length (in seconds)
 SILENCE_DURATION = MODULE_DURATION
 
+# Maximum number of onset comparisons calculated at once when scoring many
+# slices, limits memory usage of global alignment
+BATCH_SIZE = 2 ** 22
+
+
+class WordTimesIndex:
+    """
+    Holds word times in a sorted array to allow looking up all times inside a
+    window with binary search
+    """
+
+    def __init__(self, times: List[float]):
+        self.times = np.sort(np.asarray(times, dtype=float))
+
+    def __len__(self):
+        return len(self.times)
+
+    def window(self, start: float, end: float):
+        """
+        Returns all times between start and end (both inclusive)
+        """
+        start_index = np.searchsorted(self.times, start, side="left")
+        end_index = np.searchsorted(self.times, end, side="right")
+        return self.times[start_index:end_index]
+
+    def windows(self, starts: np.ndarray, duration: float):
+        """
+        Returns times of many windows of the same duration as one matrix, one
+        row per window. Rows are padded with NaN
+        """
+        start_indices = np.searchsorted(self.times, starts, side="left")
+        end_indices = np.searchsorted(self.times, starts + duration,
+                                      side="right")
+        counts = end_indices - start_indices
+        indices = start_indices[:, None] + np.arange(max(counts, default=0))
+        is_inside = indices < end_indices[:, None]
+        if len(self.times) == 0:
+            return np.full(indices.shape, np.nan)
+        return np.where(is_inside,
+                        self.times[np.minimum(indices, len(self.times) - 1)],
+                        np.nan)
+
+
+def module_onsets(modules):
+    """
+    Returns the note onsets of all modules as one matrix, one row per module.
+    Rows are padded with infinity as modules contain different numbers of
+    notes
+    """
+    lengths = [len(module["onsets"]) for module in modules]
+    onsets = np.full((len(modules), max(lengths, default=0)), np.inf)
+    for index, module in enumerate(modules):
+        onsets[index, :lengths[index]] = module["onsets"]
+    return onsets
+
+
+def batch_similarities(sources, targets, t=SIMILARITY_THRESHOLD):
+    """
+    Scores many sources against many targets at once, one batch dimension
+    first. Sources are padded with NaN, targets with infinity (see
+    module_onsets). Returns the median closeness of all onset pairs which
+    are nearer than the threshold, one value per batch and target
+    """
+    (batches, count) = targets.shape[:2]
+
+    # Compare every source onset with every target onset (batch, target,
+    # source, onset) and keep only the ones below the threshold
+    values = np.abs(sources[:, None, :, None] - targets[:, :, None, :])
+    values = values.reshape(batches, count, -1)
+    is_close = values < t
+    deltas = np.where(is_close, (t - values) / t, np.inf)
+
+    # Calculate median of every row, ignoring the padded values which got
+    # sorted to the end
+    results = np.zeros((batches, count))
+    if deltas.shape[2] > 0:
+        deltas.sort(axis=2)
+        counts = is_close.sum(axis=2)
+        lower = np.take_along_axis(
+            deltas, (np.maximum(counts - 1, 0) // 2)[..., None], axis=2)
+        upper = np.take_along_axis(deltas, (counts // 2)[..., None], axis=2)
+        results = np.where(counts > 0, (lower + upper)[..., 0] / 2, 0.0)
+
+    # Empty source and target are considered to be a perfect match
+    is_empty_source = np.isnan(sources).all(axis=1)
+    is_empty_target = np.isinf(targets).all(axis=2)
+    results[is_empty_source[:, None] & is_empty_target] = 1
+    return results
+
 
-def times_from_range(times, start, end):
-    return [t for t in times if t >= start and t <= end]
+def calculate_similarities(source, targets, t=SIMILARITY_THRESHOLD):
+    """
+    Scores one source against many targets at once, targets are given as a
+    matrix padded with infinity (see module_onsets)
+    """
+    source = np.asarray(source, dtype=float)
+    targets = np.atleast_2d(np.asarray(targets, dtype=float))
+    return batch_similarities(source[None, :], targets[None, :], t)[0]
 
 
 def calculate_similarity(source, target, t=SIMILARITY_THRESHOLD):
-    if len(target) == 0 and len(source) == 0:
-        return 1
-    deltas = np.array([])
-    for src_event in source:
-        values = [abs(src_event - trg_event) for trg_event in target]
-        deltas = np.append(deltas,
-                           [(t - v) / t for v in values if v < t])
-    result = np.median(deltas) if len(deltas) > 0 else 0.0
-    return result
+    target = np.asarray(target, dtype=float)
+    return calculate_similarities(source, target[None, :], t)[0]
 
 
 def audio_file_duration(audio_file: str):
-    with contextlib.closing(wave.open(audio_file, 'r')) as f:
-        frames = f.getnframes()
-        rate = f.getframerate()
-        duration = frames / float(rate)
-        return duration  # seconds
-
-
-def detect_word_times(audio_file: str, language_code: str = "en"):
-    if language_code not in MODEL_PATHS:
-        raise Exception(
-            "No model for language code {} given".format(language_code))
-
-    # Load ML model for speech recognition
-    model = Model(MODEL_PATHS[language_code])
-    logger.info("Loaded speech recognition model for language '{}'"
-                .format(language_code))
+    """
+    Returns duration of audio file (in seconds), the whole file gets decoded
+    when it can not be determined otherwise
+    """
+    duration = audio_duration(audio_file)
+    if duration is None:
+        total_bytes = sum(len(data) for data in decode_audio(
+            audio_file, SAMPLE_RATE, BUFFER_SIZE))
+        duration = total_bytes / 2 / SAMPLE_RATE
+    return duration
+
+
+def detect_word_times(audio_file: str,
+                      language_code: str = "en",
+                      progress: Optional[Callable[[float], None]] = None,
+                      buffer_size: int = BUFFER_SIZE,
+                      start: float = 0.0,
+                      end: Optional[float] = None):
+    # Get ML model for speech recognition, it is only loaded from disk once
+    model = model_registry.get(language_code)
 
     # Prepare speech recognition
     rec = KaldiRecognizer(model, SAMPLE_RATE)
@@ -86,159 +185,362 @@ def detect_word_times(audio_file: str, language_code: str = "en"):
                                  item['end'],
                                  item['word'][:14],
                                  item['conf']))
-            results.append(item["start"])
+            # Times are relative to the decoded part of the file
+            results.append((item["start"] + start,
+                            item["end"] + start,
+                            item["conf"]))
+
+    # Expected size of converted audio, used to report progress. Progress is
+    # only reported at the end when the duration is not known
+    total_bytes = None
+    if end is None:
+        end = audio_duration(audio_file)
+    if end is not None:
+        total_bytes = max((end - start) * SAMPLE_RATE * 2, 1)
+    read_bytes = 0
+    last_progress = 0.0
 
     # Convert audio (16khz, mono, 16bit PCM) and feed it in batches into speech
     # recognition model
-    with subprocess.Popen(["ffmpeg",
-                           "-loglevel", "quiet",
-                           "-i", audio_file,
-                           "-ar", str(SAMPLE_RATE),
-                           "-ac", "1",
-                           "-f", "s16le",
-                           "-"],
-                          stdout=subprocess.PIPE) as process:
-        while True:
-            data = process.stdout.read(BUFFER_SIZE)
-            if len(data) == 0:
-                break
-            if rec.AcceptWaveform(data):
-                append_results(rec.Result())
-            else:
-                append_results(rec.PartialResult())
-        append_results(rec.FinalResult())
+    for data in decode_audio(audio_file, SAMPLE_RATE, buffer_size,
+                             start, end):
+        if rec.AcceptWaveform(data):
+            append_results(rec.Result())
+        else:
+            append_results(rec.PartialResult())
+
+        # Report progress in steps of one percent
+        read_bytes += len(data)
+        if progress is None or total_bytes is None:
+            continue
+        current_progress = min(read_bytes / total_bytes, 1.0)
+        if current_progress - last_progress > 0.01:
+            last_progress = current_progress
+            progress(current_progress)
+    append_results(rec.FinalResult())
+
+    if progress is not None:
+        progress(1.0)
 
     return results
 
 
-def quantize_word_times(word_times: List[int]):
-    results = []
-    for word in word_times:
-        correlation = word % GRID_SIZE
-        if correlation < GRID_SIZE:
-            value = word - correlation
-            # Check for duplicates
-            if value not in results:
-                results.append(word - correlation)
-    return results
-
-
-def map_modules_to_word_times(total_duration: int,
-                              modules,
-                              word_times: List[int]):
-    offset = 0
-    result_notes = np.empty((0, 3))
+def detect_word_times_parallel(audio_file: str,
+                               language_code: str = "en",
+                               progress: Optional[Callable[[float],
+                                                           None]] = None,
+                               workers: int = ASR_WORKERS,
+                               segment_duration: float = ASR_SEGMENT_DURATION):
+    """
+    Detects word times of long audio files by splitting them at silent parts
+    and transcribing the segments in parallel processes
+    """
+    # Transcribe sequentially with only one worker or when the file is too
+    # short to get split, without analyzing it for nothing
+    if workers < 2:
+        return detect_word_times(audio_file, language_code, progress)
+    duration = audio_duration(audio_file)
+    if duration is None or duration <= segment_duration * 1.5:
+        return detect_word_times(audio_file, language_code, progress)
+
+    segments = plan_segments(audio_file, duration, segment_duration)
+
+    logger.debug("Detect word times of {} in {} segments"
+                 .format(audio_file, len(segments)))
+
+    # Load model before forking, this way all processes share its memory
+    model_registry.get(language_code)
+
+    results = [None] * len(segments)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(detect_word_times,
+                            audio_file,
+                            language_code,
+                            None,
+                            BUFFER_SIZE,
+                            segment["from"],
+                            segment["to"]): index
+            for index, segment in enumerate(segments)
+        }
+
+        # Report progress whenever a segment is done
+        for done, future in enumerate(as_completed(futures)):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress((done + 1) / len(segments))
+
+    return merge_word_times(segments, results)
+
+
+def grid_size_for_tempo(bpm: float, note_value: int = 32):
+    """
+    Returns the length of a note (in seconds) for the given tempo in quarter
+    beats per minute, for example a 32th note in 120bpm is 0.0625 seconds
+    """
+    return 60.0 / bpm * 4 / note_value
+
+
+def quantize_word_times(word_times: List[float], grid_size=GRID_SIZE):
+    """
+    Snaps all times to the previous point on the grid and returns them
+    sorted and without duplicates
+    """
+    times = np.asarray(word_times, dtype=float)
+    return np.unique(np.floor(times / grid_size) * grid_size)
+
+
+def collect_notes(modules, result_modules):
+    """
+    Copies notes of all chosen modules with their offset into one array
+    """
+    lengths = [len(modules[index - 1]["notes"]) if index > 0 else 0
+               for (index, _, _) in result_modules]
+    result_notes = np.empty((sum(lengths), 3))
+    position = 0
+    for (index, start_time, _), length in zip(result_modules, lengths):
+        if length == 0:
+            continue
+        notes = result_notes[position:position + length]
+        notes[:] = modules[index - 1]["notes"]
+        notes[:, 1:] += start_time
+        position += length
+    return result_notes
+
+
+class VoiceAnalysis(NamedTuple):
+    modules: List[Dict]
+    step_duration: float  # Time between offsets modules can start at
+    similarities: np.ndarray  # One row per offset, one column per candidate
+
+
+class Analysis(NamedTuple):
+    duration: float
+    word_times: WordTimesIndex
+    voices: List[VoiceAnalysis]
+
+
+def candidate_durations(modules):
+    # Candidates are identified by their index, silence is always the first
+    return [SILENCE_DURATION] + [module["duration"] for module in modules]
+
+
+def candidate_lengths(durations: List[float], step_duration: float):
+    # Number of offsets every candidate spans
+    return np.round(np.array(durations) / step_duration).astype(int)
+
+
+def analyze_voice(total_duration: float,
+                  modules,
+                  word_times: WordTimesIndex):
+    """
+    Scores all modules (and silence) at every offset they can start at.
+    Modules can only start on a grid of the greatest common divisor of all
+    durations, modules of the same duration are analyzed in one go
+    """
+    durations = candidate_durations(modules)
+    grid_steps = [int(round(duration / GRID_SIZE)) for duration in durations]
+    step_duration = math.gcd(*grid_steps) * GRID_SIZE
+    positions = int(np.ceil(total_duration / step_duration))
+    offsets = np.arange(positions) * step_duration
+
+    onsets = module_onsets(modules)
+    similarities = np.empty((positions, len(durations)))
+    similarities[:, 0] = similarity_matrix(
+        word_times, np.empty((1, 0)), offsets, SILENCE_DURATION)[:, 0]
+    groups = {}
+    for index, module in enumerate(modules):
+        groups.setdefault(module["duration"], []).append(index)
+    for duration, indices in groups.items():
+        similarities[:, np.add(indices, 1)] = similarity_matrix(
+            word_times, onsets[indices], offsets, duration)
+
+    return VoiceAnalysis(modules, step_duration, similarities)
+
+
+def map_modules_to_word_times(total_duration: float,
+                              voice: VoiceAnalysis,
+                              rng=random):
+    """
+    Maps modules slice by slice, always picking the one which matches the
+    word times of the current slice best
+    """
+    durations = candidate_durations(voice.modules)
+    lengths = candidate_lengths(durations, voice.step_duration)
+
+    position = 0
     result_modules = []
-
-    while offset < total_duration:
-        start_time = offset
-        results = []
-
-        # Analyze silence and add as one golden option
-        end_time = start_time + SILENCE_DURATION
-        times_range = times_from_range(word_times, start_time, end_time)
-        similarity = calculate_similarity(times_range, [])
-        results.append({
-            'similarity': similarity,
-            'is_silence': True,
-            'index': 0,
-            'start_time': start_time,
-            'end_time': end_time,
-            'notes_with_offset': [],
-        })
-
-        for index, module in enumerate(modules):
-            # Get notes of MIDI module file and apply offset
-            file = module["file"]
-            notes = module["notes"]
-            duration = module["duration"]
-
-            # Take only the starting time of each note (pitch, start, end)
-            notes_with_offset = np.array([t + start_time for t in notes])[:, 1]
-
-            # Get all offset events between this slice (start - end time)
-            end_time = start_time + duration
-            times_range = times_from_range(word_times, start_time, end_time)
-
-            # Analyze similarity of original slice with module notes
-            similarity = calculate_similarity(times_range, notes_with_offset)
-
-            final_notes = []
-            for note in notes:
-                final_notes.append(
-                    (int(note[0]), note[1] + start_time, note[2] + start_time))
-
-            # Store results
-            results.append({
-                'similarity': similarity,
-                'is_silence': False,
-                'file': file,
-                'index': index + 1,
-                'start_time': start_time,
-                'end_time': end_time,
-                'notes_with_offset': final_notes,
-            })
+    while position < len(voice.similarities):
+        start_time = position * voice.step_duration
+        similarities = voice.similarities[position]
 
         # Shuffle it before to allow different results when similarity score is
         # the same
-        shuffled = results[:]
-        random.shuffle(shuffled)
-
-        # Find most similar module for this section
-        results_winner = max(shuffled, key=lambda x: x['similarity'])
+        candidates = list(range(len(similarities)))
+        rng.shuffle(candidates)
 
-        # Add winner module to final results
-        if len(results_winner['notes_with_offset']) > 0:
-            result_notes = np.append(
-                result_notes, results_winner['notes_with_offset'], axis=0)
-        result_modules.append((
-            results_winner['index'],
-            results_winner['start_time'],
-            results_winner['end_time']))
+        # Find most similar module for this section and remember it, notes
+        # are only collected at the end
+        winner = max(candidates, key=lambda x: similarities[x])
+        end_time = start_time + durations[winner]
+        result_modules.append((winner, start_time, end_time))
 
         # Prepare offset for next iteration
-        offset = results_winner['end_time']
+        position += int(lengths[winner])
 
         # Debug logging
         logger.debug('-----------------')
-        logger.debug("{}s - {}s".format(results_winner['start_time'],
-                                        results_winner['end_time']))
+        logger.debug("{}s - {}s".format(start_time, end_time))
         logger.debug('-----------------')
-        for r in results:
-            win = "✔" if results_winner['index'] == r['index'] else ""
-            score = r['similarity'] if r['similarity'] != 0.0 else 0
+        for index, similarity in enumerate(similarities):
+            win = "✔" if winner == index else ""
+            score = similarity if similarity != 0.0 else 0
             logger.debug("{0:>2}: {1:10.2%} {2}"
-                         .format(r['index'], score, win))
-
-    return result_notes, result_modules
+                         .format(index, score, win))
+
+    return collect_notes(voice.modules, result_modules), result_modules
+
+
+def similarity_matrix(word_times: WordTimesIndex,
+                      onsets: np.ndarray,
+                      offsets: np.ndarray,
+                      duration: float):
+    """
+    Scores modules of the same duration at every given offset, returns a
+    matrix with one row per offset and one column per module. Offsets are
+    processed in batches to limit memory usage
+    """
+    sources = word_times.windows(offsets, duration)
+    comparisons = max(sources.shape[1] * onsets.shape[0] * onsets.shape[1], 1)
+    batch_size = max(BATCH_SIZE // comparisons, 1)
+
+    results = np.empty((len(offsets), len(onsets)))
+    for start in range(0, len(offsets), batch_size):
+        end = start + batch_size
+        targets = onsets[None, :, :] + offsets[start:end, None, None]
+        results[start:end] = batch_similarities(sources[start:end], targets)
+    return results
 
 
-def generate_notes(audio_file: str, language: str):
+def align_modules_to_word_times(total_duration: float,
+                                voice: VoiceAnalysis,
+                                rng=random):
+    """
+    Finds the sequence of modules (and silences) which matches the word times
+    best over the whole file. The best path through the scores of all
+    modules at all offsets is found with dynamic programming
+    """
+    durations = candidate_durations(voice.modules)
+    lengths = candidate_lengths(durations, voice.step_duration)
+    positions = len(voice.similarities)
+
+    # Weight similarity by duration, this way longer modules are not
+    # disadvantaged against many shorter ones
+    gains = voice.similarities * np.array(durations)
+
+    # Best score to reach every position together with the candidate and
+    # position we came from
+    end = positions + lengths.max()
+    scores = np.full(end, -np.inf)
+    scores[0] = 0
+    choices = np.zeros(end, dtype=int)
+    previous = np.zeros(end, dtype=int)
+    length_groups = [np.flatnonzero(lengths == length)
+                     for length in np.unique(lengths)]
+    for position in range(positions):
+        if scores[position] == -np.inf:
+            continue
+        for candidates in length_groups:
+            # Pick the best candidate of this length, randomly choose one
+            # when scores are the same
+            values = gains[position, candidates]
+            winners = candidates[values == values.max()]
+            winner = winners[rng.randrange(len(winners))]
+            target = position + lengths[winner]
+            score = scores[position] + gains[position, winner]
+            if score > scores[target]:
+                scores[target] = score
+                choices[target] = winner
+                previous[target] = position
+
+    # Follow the best path backwards from the end of the file
+    position = positions + int(np.argmax(scores[positions:]))
+    result_modules = []
+    while position > 0:
+        winner = int(choices[position])
+        start_time = float(previous[position] * voice.step_duration)
+        result_modules.append(
+            (winner, start_time, start_time + durations[winner]))
+        position = previous[position]
+    result_modules.reverse()
+
+    logger.debug("Aligned {} modules with score {:0.2f}".format(
+        len(result_modules), scores[positions:].max()))
+
+    return collect_notes(voice.modules, result_modules), result_modules
+
+
+def analyze_recording(
+    audio_file: str,
+    language: str,
+    word_times: Optional[List[Tuple[float, float, float]]] = None,
+    grid_size: float = GRID_SIZE,
+):
+    """
+    Analyzes everything about a recording which does not depend on the seed,
+    all variants generated from it share the result
+    """
     # Determine total duration of file
     duration = audio_file_duration(audio_file)
     logger.info("Read audio file: {}, {}hz, {:0.2f}s"
                 .format(audio_file, SAMPLE_RATE, duration))
 
-    # Detect all spoken words inside the audio and return times
-    word_times = detect_word_times(audio_file, language)
+    # Detect all spoken words inside the audio and return times, skip this
+    # step when they are already known
+    if word_times is None:
+        word_times = detect_word_times(audio_file, language)
     logger.info("Detected {} words".format(len(word_times)))
 
-    # Quantize all times so they fit a grid
-    quantized_word_times = quantize_word_times(word_times)
-
-    # Generate two separate voices
-    result_notes = []
-    result_module_indices = []
-    for midi_modules in [MIDI_MODULES_1, MIDI_MODULES_2]:
-        # Load MIDI files for this voice
-        modules = load_midi_modules(midi_modules)
-
-        # Try to map modules as close as possible to word times
-        notes, module_indices = map_modules_to_word_times(
-            duration, modules, quantized_word_times)
-
-        result_notes.append(notes.tolist())
-        result_module_indices.append(module_indices)
+    # Quantize all start times so they fit a grid and index them for fast
+    # lookups
+    quantized_word_times = WordTimesIndex(quantize_word_times(
+        [word[0] for word in word_times], grid_size))
+
+    # Load MIDI files for both voices and score their modules against the
+    # word times
+    voices = [analyze_voice(duration,
+                            load_midi_modules(midi_modules),
+                            quantized_word_times)
+              for midi_modules in [MIDI_MODULES_1, MIDI_MODULES_2]]
+
+    return Analysis(duration, quantized_word_times, voices)
+
+
+def generate_notes(
+    analysis: Analysis,
+    alignment: str = ALIGNMENT,
+    context: Optional[GenerationContext] = None,
+):
+    if context is None:
+        context = GenerationContext()
+
+    # Every voice gets its own random generator derived from the seed
+    voice_contexts = context.fork(len(analysis.voices))
+
+    # Try to map modules as close as possible to word times, either slice by
+    # slice or over the whole file at once
+    map_modules = map_modules_to_word_times
+    if alignment == AlignmentEnum.global_:
+        map_modules = align_modules_to_word_times
+
+    # Generate two separate voices, all scores are already known and the
+    # remaining choices are quick
+    results = [map_modules(analysis.duration, voice, voice_context.random)
+               for (voice, voice_context) in zip(analysis.voices,
+                                                 voice_contexts)]
+
+    result_notes = [notes.tolist() for (notes, _) in results]
+    result_module_indices = [module_indices for (_, module_indices) in results]
 
     logger.info("Finished generating notes")
     return (result_notes, result_module_indices)
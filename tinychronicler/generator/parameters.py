@@ -1,11 +1,13 @@
-import random
 import subprocess
-from typing import Any, List, Tuple
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
 
-import numpy as np
 from loguru import logger
 
+from .context import GenerationContext
 
+
+@lru_cache(maxsize=128)
 def get_video_length(file):
     result = subprocess.run(["ffprobe", "-v", "error", "-show_entries",
                              "format=duration", "-of",
@@ -38,9 +40,13 @@ def check_movements(config):
 def generate_parameters(modules: List[List[Tuple[int, int]]],
                         movements: List[Any],
                         video_files: List[str],
-                        image_files: List[str]):
+                        image_files: List[str],
+                        context: Optional[GenerationContext] = None):
     logger.info("Generate movements for score")
 
+    if context is None:
+        context = GenerationContext()
+
     # check_movements(movements)
 
     # Get video durations
@@ -62,8 +68,10 @@ def generate_parameters(modules: List[List[Tuple[int, int]]],
     last_image_index = 0
 
     # Shuffle the files before, so the outcome is always a little different
-    random.shuffle(video_files)
-    random.shuffle(image_files)
+    video_files = list(video_files)
+    image_files = list(image_files)
+    context.random.shuffle(video_files)
+    context.random.shuffle(image_files)
 
     # Go through all modules and find parameters for each of them
     results = []
@@ -96,7 +104,8 @@ def generate_parameters(modules: List[List[Tuple[int, int]]],
         scenes_probabilities = [s['percentage'] for s in scenes]
 
         # Randomly find scene with parameters
-        scene = np.random.choice(scenes, None, True, scenes_probabilities)
+        scene = scenes[context.numpy.choice(len(scenes),
+                                            p=scenes_probabilities)]
         logger.debug("Pick scene {} for module #{} w. {}".format(
             scene['name'], index, ",".join(scene["parameters"])))
         result = {"parameters": scene['parameters'], "module": (
@@ -118,14 +127,14 @@ def generate_parameters(modules: List[List[Tuple[int, int]]],
                 # If we reached the end of the files list, start from the top
                 # again but with a re-shuffled set of files
                 if len(image_files) < last_image_index + 1:
-                    random.shuffle(image_files)
+                    context.random.shuffle(image_files)
                     last_image_index = 0
             elif ("VIDEO" in scene["parameters"] and
                     "VIDEO" not in previous_scene["parameters"]):
                 # Pick video
                 result["media"] = video_files[last_video_index]
                 # Pick a random starting point in the video
-                result["media_from"] = random.uniform(
+                result["media_from"] = context.random.uniform(
                     0,
                     durations[last_video_index])
                 # Prepare the next video for next time
@@ -133,7 +142,7 @@ def generate_parameters(modules: List[List[Tuple[int, int]]],
                 # If we reached the end of the files list, start from the top
                 # again but with a re-shuffled set of files
                 if len(video_files) < last_video_index + 1:
-                    random.shuffle(video_files)
+                    context.random.shuffle(video_files)
                     last_video_index = 0
         except IndexError:
             raise Exception(
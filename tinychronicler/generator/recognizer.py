@@ -0,0 +1,115 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List
+
+from loguru import logger
+from vosk import Model
+
+from tinychronicler.constants import MODEL_MEMORY_BUDGET, MODEL_PATHS
+
+
+def model_size(model_path: str):
+    """
+    Returns the total size of all model files on disk (in bytes), we use it
+    as an estimate of the memory a loaded model will occupy
+    """
+    size = 0
+    for root, directories, files in os.walk(model_path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+
+def model_version(language_code: str):
+    """
+    Returns the name of the speech recognition model used for a language
+    """
+    return os.path.basename(MODEL_PATHS[language_code])
+
+
+class ModelRegistry:
+    """
+    Keeps loaded speech recognition models around so they can be shared
+    across generations. Least recently used models get evicted as soon as the
+    memory budget (in bytes) would be exceeded.
+    """
+
+    def __init__(self, memory_budget: int = MODEL_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.models: Dict[str, Model] = OrderedDict()
+        self.sizes: Dict[str, int] = {}
+        self.load_times: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    @property
+    def memory_used(self):
+        return sum(self.sizes.values())
+
+    def get(self, language_code: str) -> Model:
+        if language_code not in MODEL_PATHS:
+            raise Exception(
+                "No model for language code {} given".format(language_code))
+
+        with self.lock:
+            if language_code in self.models:
+                self.hits += 1
+                self.models.move_to_end(language_code)
+                return self.models[language_code]
+
+            self.misses += 1
+            return self.load(language_code)
+
+    def load(self, language_code: str) -> Model:
+        model_path = MODEL_PATHS[language_code]
+        size = model_size(model_path)
+
+        # Make room for the new model first, we always keep at least the
+        # requested one, even if it is larger than the whole budget
+        while (len(self.models) > 0 and
+                self.memory_used + size > self.memory_budget):
+            self.evict()
+
+        start = time.perf_counter()
+        model = Model(model_path)
+        load_time = time.perf_counter() - start
+
+        self.models[language_code] = model
+        self.sizes[language_code] = size
+        self.load_times[language_code] = load_time
+        logger.info("Loaded speech recognition model for language '{}' "
+                    "in {:0.2f}s ({:0.1f}MB)"
+                    .format(language_code, load_time, size / 1000 / 1000))
+        return model
+
+    def evict(self):
+        # Remove least recently used model, it gets freed as soon as the last
+        # recognizer holding a reference to it is done
+        language_code, _ = self.models.popitem(last=False)
+        del self.sizes[language_code]
+        self.evictions += 1
+        logger.info("Evicted speech recognition model for language '{}'"
+                    .format(language_code))
+
+    def preload(self, language_codes: List[str]):
+        for language_code in language_codes:
+            self.get(language_code)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "loaded": list(self.models.keys()),
+                "memory_used": self.memory_used,
+                "memory_budget": self.memory_budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "load_times": dict(self.load_times),
+            }
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,98 @@
+import contextlib
+import wave
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .decoder import SAMPLE_FORMATS, open_wav, to_mono
+
+# Length of frames to measure loudness with (in seconds)
+ENERGY_FRAME_DURATION = 0.1
+
+# Look for the quietest moment within this portion of the segment duration
+# around every planned cut
+SILENCE_SEARCH = 0.25
+
+# Segments are extended by this overlap on both sides (in seconds), to not
+# lose words at the cuts
+SEGMENT_OVERLAP = 2.0
+
+
+def frame_energies(audio_file: str, frame_duration=ENERGY_FRAME_DURATION):
+    """
+    Returns mean energy of consecutive frames of a WAV file
+    """
+    with contextlib.closing(open_wav(audio_file)) as f:
+        channels = f.getnchannels()
+        dtype = SAMPLE_FORMATS[f.getsampwidth()]
+        frame_size = max(int(f.getframerate() * frame_duration), 1)
+
+        energies = []
+        while True:
+            # Read many frames at once, the last one might be incomplete
+            data = f.readframes(frame_size * 100)
+            if len(data) == 0:
+                break
+            samples = to_mono(data, dtype, channels)
+            padding = -len(samples) % frame_size
+            samples = np.pad(samples, (0, padding))
+            energies.append(
+                np.square(samples).reshape(-1, frame_size).mean(axis=1))
+
+    return np.concatenate(energies) if len(energies) > 0 else np.zeros(0)
+
+
+def plan_segments(audio_file: str,
+                  duration: float,
+                  segment_duration: float,
+                  overlap=SEGMENT_OVERLAP):
+    """
+    Splits an audio file into segments of roughly the given duration (in
+    seconds), cutting at the quietest moments. Every segment owns the words
+    between "start" and "end" and gets decoded from "from" to "to" which
+    includes the overlap
+    """
+    try:
+        energies = frame_energies(audio_file)
+    except (wave.Error, EOFError):
+        # Cut at fixed positions when we can not analyze the file
+        energies = np.zeros(0)
+
+    cuts = [0.0]
+    while duration - cuts[-1] > segment_duration * 1.5:
+        target = cuts[-1] + segment_duration
+        search_from = int((target - segment_duration * SILENCE_SEARCH) /
+                          ENERGY_FRAME_DURATION)
+        search_to = int((target + segment_duration * SILENCE_SEARCH) /
+                        ENERGY_FRAME_DURATION)
+        window = energies[search_from:search_to]
+        if len(window) > 0:
+            target = float(search_from + np.argmin(window) + 0.5) * \
+                ENERGY_FRAME_DURATION
+        cuts.append(target)
+    cuts.append(duration)
+
+    segments = []
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        segments.append({
+            "start": start,
+            "end": end,
+            "from": max(start - overlap, 0.0),
+            "to": min(end + overlap, duration),
+        })
+    return segments
+
+
+def merge_word_times(segments: List[Dict],
+                     results: List[List[Tuple[float, float, float]]]):
+    """
+    Combines word times of all segments, words detected in the overlap of a
+    segment are dropped as they belong to its neighbour
+    """
+    merged = []
+    for segment, word_times in zip(segments, results):
+        for word in word_times:
+            if segment["start"] <= word[0] < segment["end"]:
+                merged.append(word)
+    merged.sort(key=lambda word: word[0])
+    return merged
@@ -1,7 +1,11 @@
+import hashlib
 import os
 import shutil
 import tempfile
 from contextlib import contextmanager
+from functools import lru_cache
+
+CHUNK_SIZE_1MB = 1000 * 1000  # in bytes
 
 
 @contextmanager
@@ -12,3 +16,24 @@ def temporary_file(file_ext: str):
     tmp_dir = tempfile.mkdtemp()
     yield os.path.join(tmp_dir, "out{}".format(file_ext))
     shutil.rmtree(tmp_dir)
+
+
+@lru_cache(maxsize=128)
+def content_hash(file_path: str, modified_at: int, size: int):
+    hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE_1MB)
+            if not chunk:
+                break
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def file_hash(file_path: str):
+    """
+    Returns SHA256 hash of the file contents. Results are remembered as long
+    as the file does not change.
+    """
+    stat = os.stat(file_path)
+    return content_hash(file_path, stat.st_mtime_ns, stat.st_size)
@@ -1,30 +1,331 @@
-from typing import List, Union
+import asyncio
+import re
+import socket
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Callable, Deque, List, Optional, Set, Tuple, Union
 
 from loguru import logger
 from pythonosc.osc_message_builder import OscMessageBuilder
-from pythonosc.udp_client import UDPClient
+from pythonosc.parsing import osc_types
 
+from tinychronicler.constants import OSC_TARGETS
 from tinychronicler.server.ws import ws_manager
 
-UDP_HOST = "127.0.0.1"
-UDP_PORT = 51230
+# Number of encoded messages to keep, most messages of a performance (beats,
+# notes, muting) are the same every time
+MESSAGE_CACHE_SIZE = 1024
 
-client = UDPClient(UDP_HOST, UDP_PORT)
+# Maximum number of datagrams waiting for a target which can not keep up,
+# further ones are dropped
+TARGET_QUEUE_SIZE = 256
 
+BUNDLE_PREFIX = osc_types.write_string("#bundle")
 
-def send_message(
-    address: str,
-    *args: List[Union[str, bytes, bool, int, float, tuple, list]]
-):
-    # Create OSC message
+# Time (in seconds since epoch) sent messages should take effect at. When set
+# they are sent as timetagged bundles to targets with a look ahead, all other
+# receivers get them once that time is reached
+timetag: ContextVar[Optional[float]] = ContextVar("timetag", default=None)
+
+# Messages waiting for their time, for receivers which ignore timetags
+held_messages: Set[asyncio.TimerHandle] = set()
+
+
+@contextmanager
+def scheduled_at(at: float):
+    """
+    Sends all OSC messages of this context as bundles which the receiver
+    executes at the given time
+    """
+    token = timetag.set(at)
+    try:
+        yield
+    finally:
+        timetag.reset(token)
+
+
+def hold_until(at: float, send: Callable[[bytes], None], dgram: bytes):
+    """
+    Sends datagram once the given time (in seconds since epoch) is reached
+    """
+    delay = at - time.time()
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        delay = 0
+    if delay <= 0:
+        send(dgram)
+        return
+
+    def send_held():
+        held_messages.discard(handle)
+        send(dgram)
+
+    handle = loop.call_later(delay, send_held)
+    held_messages.add(handle)
+
+
+def cancel_held_messages():
+    """
+    Drops all messages which are still waiting for their time, for example
+    when a performance got stopped
+    """
+    for handle in held_messages:
+        handle.cancel()
+    held_messages.clear()
+
+
+def build_message(address: str, *args) -> bytes:
     builder = OscMessageBuilder(address=address)
     for arg in args:
         builder.add_arg(arg)
-    message = builder.build()
-    logger.debug("Send OSC message: {} {}".format(address, args))
+    return builder.build().dgram
+
+
+# Arguments are cached with their type, 1 and 1.0 are different OSC messages
+cached_message = lru_cache(maxsize=MESSAGE_CACHE_SIZE, typed=True)(
+    build_message)
+
+
+def encode_message(address: str, *args) -> bytes:
+    try:
+        return cached_message(address, *args)
+    except TypeError:
+        # Arguments like lists can not be cached
+        return build_message(address, *args)
+
+
+def encode_bundle(at: float, dgram: bytes) -> bytes:
+    """
+    Wraps an encoded message in a bundle with a timetag
+    """
+    return b"".join([
+        BUNDLE_PREFIX,
+        osc_types.write_date(at),
+        osc_types.write_int(len(dgram)),
+        dgram,
+    ])
+
+
+class OscProtocol(asyncio.DatagramProtocol):
+    def __init__(self, target: "OscTarget"):
+        self.target = target
+
+    def error_received(self, exc: Exception):
+        self.target.errors += 1
+        logger.debug("Could not send OSC message to {}: {}", self.target, exc)
+
+    def pause_writing(self):
+        self.target.paused = True
+
+    def resume_writing(self):
+        self.target.paused = False
+        self.target.flush()
+
+    def connection_lost(self, exc: Optional[Exception]):
+        if exc is not None:
+            logger.warning("Lost connection to OSC target {}: {}",
+                           self.target, exc)
+        self.target.transport = None
+
+
+class OscTarget:
+    """
+    Receiver of OSC messages via UDP, optionally only of messages with
+    certain address prefixes. Datagrams are sent right away as long as the
+    target keeps up, otherwise they wait in a bounded queue of this target
+    and are dropped when it is full. This way a slow or unreachable target
+    never delays the other ones.
 
-    # Send via WebSocket
-    ws_manager.broadcast(message.dgram)
+    Targets with a look ahead (in seconds) schedule messages by their
+    timetag, they get messages of a performance that much earlier as
+    bundles. All other targets get plain messages at their time.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 prefixes: Optional[Tuple[str, ...]] = None,
+                 look_ahead: float = 0.0,
+                 queue_size: int = TARGET_QUEUE_SIZE):
+        self.host = host
+        self.port = port
+        self.prefixes = prefixes
+        self.look_ahead = look_ahead
+        self.queue: Deque[bytes] = deque()
+        self.queue_size = queue_size
+        self.transport: asyncio.DatagramTransport = None
+        self.socket: socket.socket = None
+        self.is_started = False
+        self.paused = False
+
+        # Health of this target
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @classmethod
+    def parse(cls, value: str):
+        """
+        Creates target from a string like "host:port", optionally followed by
+        its look ahead and the address prefixes it receives, for example
+        "192.168.1.20:9000@0.1/video,/image"
+        """
+        match = re.fullmatch(r"([^:/@]+):(\d+)(?:@(\d+(?:\.\d*)?))?(/.*)?",
+                             value)
+        if match is None:
+            raise Exception("Invalid OSC target '{}'".format(value))
+        (host, port, look_ahead, prefixes) = match.groups()
+        return cls(host,
+                   int(port),
+                   tuple(prefixes.split(",")) if prefixes else None,
+                   float(look_ahead) if look_ahead else 0.0)
+
+    def __str__(self):
+        return "{}:{}".format(self.host, self.port)
+
+    def accepts(self, address: str):
+        return self.prefixes is None or address.startswith(self.prefixes)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.is_started = True
+        try:
+            (self.transport, _) = await loop.create_datagram_endpoint(
+                lambda: OscProtocol(self), remote_addr=(self.host, self.port))
+        except OSError as err:
+            self.errors += 1
+            logger.error("Could not connect to OSC target {}: {}", self, err)
+
+    def stop(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        self.is_started = False
+        self.paused = False
+        self.queue.clear()
+
+    def send(self, dgram: bytes):
+        if not self.is_started:
+            self.send_blocking(dgram)
+        elif self.transport is None:
+            self.dropped += 1
+        elif self.paused or len(self.queue) > 0:
+            # Wait until the transport can take more
+            if len(self.queue) >= self.queue_size:
+                self.dropped += 1
+                logger.debug("Drop OSC message to {}", self)
+            else:
+                self.queue.append(dgram)
+        else:
+            self.transport.sendto(dgram)
+            self.sent += 1
+
+    def send_blocking(self, dgram: bytes):
+        # Used before the transport got started
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.socket.sendto(dgram, (self.host, self.port))
+            self.sent += 1
+        except OSError as err:
+            self.errors += 1
+            logger.debug("Could not send OSC message to {}: {}", self, err)
+
+    def flush(self):
+        while (len(self.queue) > 0 and not self.paused and
+                self.transport is not None):
+            self.transport.sendto(self.queue.popleft())
+            self.sent += 1
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "port": self.port,
+            "addresses": list(self.prefixes) if self.prefixes else None,
+            "look_ahead": self.look_ahead,
+            "is_connected": self.transport is not None,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queued": len(self.queue),
+        }
+
+
+class OscOutput:
+    """
+    Sends OSC datagrams to all targets interested in their address. Once
+    started they are handed over to asyncio transports which never block the
+    event loop.
+    """
+
+    def __init__(self, targets: List[str] = OSC_TARGETS):
+        self.targets = [OscTarget.parse(target) for target in targets]
+
+    @property
+    def look_ahead(self):
+        """
+        Returns how early messages of a performance need to be sent to
+        satisfy all targets
+        """
+        return max((target.look_ahead for target in self.targets),
+                   default=0.0)
+
+    def configure(self, targets: List[str]):
+        self.stop()
+        self.targets = [OscTarget.parse(target) for target in targets]
+
+    async def start(self):
+        for target in self.targets:
+            await target.start()
+
+    def stop(self):
+        for target in self.targets:
+            target.stop()
+
+    def send(self, address: str, dgram: bytes, at: Optional[float] = None):
+        """
+        Sends datagram to all interested targets, when a time is given they
+        execute it then
+        """
+        bundle = None
+        for target in self.targets:
+            if not target.accepts(address):
+                continue
+            if at is None:
+                target.send(dgram)
+            elif target.look_ahead > 0:
+                if bundle is None:
+                    bundle = encode_bundle(at, dgram)
+                target.send(bundle)
+            else:
+                hold_until(at, target.send, dgram)
+
+    def stats(self):
+        return {
+            "targets": [target.stats() for target in self.targets],
+        }
+
+
+osc_output = OscOutput()
+
+
+def send_message(
+    address: str,
+    *args: List[Union[str, bytes, bool, int, float, tuple, list]]
+):
+    dgram = encode_message(address, *args)
+    logger.debug("Send OSC message: {} {}", address, args)
 
-    # Send via UDP
-    client.send(message)
+    at = timetag.get()
+    if at is None:
+        # Send via WebSocket and UDP right away
+        ws_manager.broadcast(dgram)
+        osc_output.send(address, dgram)
+    else:
+        # WebSocket clients do not understand timetags, hold it back for them
+        hold_until(at, ws_manager.broadcast, dgram)
+        osc_output.send(address, dgram, at)
@@ -1,12 +1,24 @@
 import logging
 import sys
+from typing import List
 
 import click
 from loguru import logger
 from uvicorn import Config, Server
 
-from .constants import LOG_LEVELS
-from .database import engine, models
+from .constants import (
+    ASR_WORKERS,
+    COMPOSITION_WORKERS,
+    LOG_LEVELS,
+    MODEL_MEMORY_BUDGET,
+    MODEL_PATHS,
+    OSC_TARGETS,
+    TRANSCRIBE_ON_UPLOAD,
+)
+from .database import engine, migrate
+from .generator import model_registry
+from .io.osc import osc_output
+from .server.tasks import job_queue
 from .version import version
 
 
@@ -94,7 +106,59 @@ def setup_server(host: str, port: int, log_level: str):
     help="Log level.",
     show_default=True,
 )
-def main(host: str, port: int, log_level: str):
+@click.option(
+    "--preload-model",
+    type=click.Choice(list(MODEL_PATHS.keys())),
+    multiple=True,
+    help="Load speech recognition model for this language on startup.",
+)
+@click.option(
+    "--model-memory-budget",
+    type=int,
+    default=int(MODEL_MEMORY_BUDGET / 1000 / 1000),
+    help="Max. memory of loaded speech recognition models (in MB).",
+    show_default=True,
+)
+@click.option(
+    "--composition-workers",
+    type=click.IntRange(min=1),
+    default=COMPOSITION_WORKERS,
+    help="Number of processes generating compositions.",
+    show_default=True,
+)
+@click.option(
+    "--asr-workers",
+    type=click.IntRange(min=1),
+    default=ASR_WORKERS,
+    help="Number of processes detecting word times of long recordings.",
+    show_default=True,
+)
+@click.option(
+    "--transcribe-on-upload/--no-transcribe-on-upload",
+    default=TRANSCRIBE_ON_UPLOAD,
+    help="Start speech recognition right after an audio upload.",
+    show_default=True,
+)
+@click.option(
+    "--osc-target",
+    type=str,
+    multiple=True,
+    default=OSC_TARGETS,
+    help="Send OSC messages to this HOST:PORT, optionally followed by a look "
+    "ahead in seconds for receivers scheduling timetagged bundles and the "
+    "only address prefixes it receives, e.g. "
+    "192.168.1.20:9000@0.1/video,/image.",
+    show_default=True,
+)
+def main(host: str,
+         port: int,
+         log_level: str,
+         preload_model: List[str],
+         model_memory_budget: int,
+         composition_workers: int,
+         asr_workers: int,
+         transcribe_on_upload: bool,
+         osc_target: List[str]):
     print("""
     TINY CHRONICLER v{} ~ @( * O * )@
     ♪ﾟ+.ｏ.+ﾟ♪ﾟ+.ｏ.+ﾟ♪ﾟ+.ｏ.+ﾟ♪ﾟ+.ｏ.+♪
@@ -110,7 +174,7 @@ def main(host: str, port: int, log_level: str):
     """.format(version, host, port, log_level))
 
     # Run all migrations
-    models.Base.metadata.create_all(bind=engine)
+    migrate(engine)
 
     # Start HTTP server hosting web interface for users
     server = setup_server(host, port, log_level)
@@ -118,5 +182,21 @@ def main(host: str, port: int, log_level: str):
     # Set up logging after server setup to make sure it overrides everything
     setup_logging(log_level)
 
+    # Speech recognition runs in the worker processes, they load models on
+    # startup
+    model_registry.memory_budget = model_memory_budget * 1000 * 1000
+
+    # Configure workers generating compositions
+    job_queue.workers = composition_workers
+    job_queue.preload_models = preload_model
+    job_queue.asr_workers = asr_workers
+    job_queue.transcribe_on_upload = transcribe_on_upload
+
+    # Configure receivers of OSC messages sent during performances
+    try:
+        osc_output.configure(osc_target)
+    except Exception as err:
+        raise click.BadParameter(str(err), param_hint="--osc-target")
+
     # Start server and block thread from here on
     server.run()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from loguru import logger
+
+# Events triggered later than this (in seconds) are reported as warnings
+LATENESS_WARNING = 0.02
+
+
+class PerformanceClock:
+    """
+    Schedules events of a performance at absolute deadlines measured from
+    one anchor (the moment the clock got created). Delays caused by jitter or
+    processing time do not add up, late events are followed by earlier
+    wake-ups.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.anchor = self.loop.time()
+        self.system_anchor = time.time()
+        self.events = 0
+        self.late_events = 0
+        self.max_lateness = 0.0
+
+    def time(self):
+        """
+        Returns seconds passed since the anchor
+        """
+        return self.loop.time() - self.anchor
+
+    def system_time(self, deadline: float):
+        """
+        Returns the deadline as system time (in seconds since epoch), for
+        example to schedule it at a receiver
+        """
+        return self.system_anchor + deadline
+
+    async def wait_until(self, deadline: float, event: str = "event"):
+        """
+        Sleeps until the given deadline (in seconds after the anchor) and
+        returns how late we woke up
+        """
+        delay = deadline - self.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lateness = max(self.time() - deadline, 0.0)
+
+        self.events += 1
+        self.max_lateness = max(self.max_lateness, lateness)
+        if lateness > LATENESS_WARNING:
+            self.late_events += 1
+            logger.warning("{} at {:.3f}s is {:.1f}ms late",
+                           event, deadline, lateness * 1000)
+        else:
+            logger.debug("{} at {:.3f}s is {:.1f}ms late",
+                         event, deadline, lateness * 1000)
+        return lateness
+
+    def report(self):
+        logger.debug("Performed {} events, {} late, max. lateness {:.1f}ms",
+                     self.events, self.late_events, self.max_lateness * 1000)
@@ -3,18 +3,14 @@ import random
 
 from loguru import logger
 
-from tinychronicler.constants import MODULE_DURATION
 from tinychronicler.database import schemas
-from tinychronicler.io import (
+from tinychronicler.io.audio import (
     mute_audio,
     play_audio,
     play_beat,
     play_count_in,
     play_note,
-    play_video,
-    show_image,
     stop_audio,
-    stop_video_or_image,
     unmute_audio,
 )
 from tinychronicler.io.led import (
@@ -27,19 +23,17 @@ from tinychronicler.io.led import (
     reset_eyes,
     reset_mouth,
 )
+from tinychronicler.io.osc import (
+    cancel_held_messages,
+    osc_output,
+    scheduled_at,
+)
+from tinychronicler.io.video import play_video, show_image, stop_video_or_image
 
-tasks = set()
-
-SILENCE_MODULE = 0
-HUMAN_PARAMETERS = ["HUMAN_1", "HUMAN_2", "HUMAN_3", "HUMAN_4"]
-ROBOT_PARAMETERS = ["ROBOT_1", "ROBOT_2", "ROBOT_BASS"]
-
+from .clock import PerformanceClock
+from .timeline import Timeline, compile_timeline
 
-def contains(a, b):
-    for item in a:
-        if item in b:
-            return True
-    return False
+tasks = set()
 
 
 def trigger_audio(media: str):
@@ -84,32 +78,6 @@ def trigger_note(voice: str, note: int):
     play_note(voice, note)
 
 
-async def perform_voice(voice: str, notes):
-    last_start = 0
-    try:
-        for note in notes:
-            delay = note[1] - last_start
-            if delay > 0:
-                await asyncio.sleep(delay)
-            trigger_note(voice, note[0])
-            last_start = note[1]
-    except asyncio.CancelledError:
-        pass
-
-
-def prepare_voice_performance(voice: str, notes, start_time, end_time):
-    to_be_performed = []
-    for note in notes:
-        if note[1] >= start_time and note[2] <= end_time:
-            to_be_performed.append(
-                (note[0], note[1] - start_time, note[2] - start_time))
-    if len(to_be_performed) > 0:
-        # Play notes in separate task
-        task = asyncio.create_task(perform_voice(voice, to_be_performed))
-        tasks.add(task)
-        task.add_done_callback(tasks.discard)
-
-
 async def perform_blinking(count_in: bool, show_mouth: bool):
     if not count_in:
         # Visual fun
@@ -147,124 +115,53 @@ def prepare_blinking(count_in: bool, show_mouth: bool):
     task.add_done_callback(tasks.discard)
 
 
-async def perform(audio_file_path: str,
-                  composition_data: schemas.CompositionData,
-                  is_demo=False):
-    # Composition data
-    current_module_index = 0
-    modules = composition_data["parameters"]
-    notes = composition_data["notes"]
-    notes_human = notes[0]
-    notes_robot = notes[1]
-    total_modules = len(modules)
-
-    # Performance state
-    video = None
-    photo = None
-    audio_enabled = True
-    human_voice_enabled = True
-    robot_voice_enabled = True
-    count_in = True
-
-    # Prepare stage
-    trigger_photo_and_video_stop()
-    unmute_narrator()
-    print_background()
-
-    # Count in!
-    await asyncio.sleep(MODULE_DURATION)
-    play_audio(audio_file_path)
-    print_mouth()
+ACTIONS = {
+    "stop_media": trigger_photo_and_video_stop,
+    "video": trigger_video,
+    "photo": trigger_photo,
+    "mute_narrator": mute_narrator,
+    "unmute_narrator": unmute_narrator,
+    "play_audio": play_audio,
+    "print_background": print_background,
+    "print_mouth": print_mouth,
+    "note": trigger_note,
+    "count_in": play_count_in,
+    "beat": play_beat,
+    "blink": prepare_blinking,
+}
+
+
+async def perform(timeline: Timeline):
+    # All events are scheduled relative to the start of the performance,
+    # this way the score does not drift away from the narrator audio
+    clock = PerformanceClock()
+    module_index = 0
 
     # Play score!
     try:
-        while current_module_index < total_modules:
-            # Get composition data for next module
-            module = modules[current_module_index]
-            parameters = module["parameters"]
-            (id_1, id_2, start_time, end_time) = module["module"]
-            media = module["media"] if "media" in module else None
-            media_from = (
-                module["media_from"] if "media_from" in module else None)
-
-            # Print some debugging info
-            logger.debug("=============")
-            logger.debug("Module #{} ({}, {})",
-                         current_module_index, id_1, id_2)
-            logger.debug("Parameters: {} {}s-{}s, Media: {}".format(
-                         ", ".join(parameters), start_time, end_time, media))
-
-            # Performance state machine
-            if "VIDEO" in parameters and video is None:
-                video = media
-                trigger_video(media, media_from)
-            elif "PHOTO" in parameters and photo is None:
-                photo = media
-                trigger_photo(media)
-            elif ("VIDEO" not in parameters
-                    and "PHOTO" not in parameters
-                    and (video is not None or photo is not None)):
-                video = None
-                photo = None
-                trigger_photo_and_video_stop()
-
-            if ("NARRATOR" in parameters and not audio_enabled):
-                audio_enabled = True
-                unmute_narrator()
-            elif ("NARRATOR" not in parameters and audio_enabled):
-                audio_enabled = False
-                mute_narrator()
-
-            # Performance state machine for voices (and demo mode)
-            if (contains(HUMAN_PARAMETERS, parameters)
-                    and not human_voice_enabled):
-                human_voice_enabled = True
-            elif (not contains(HUMAN_PARAMETERS, parameters)
-                    and human_voice_enabled):
-                human_voice_enabled = False
-
-            if (contains(ROBOT_PARAMETERS, parameters)
-                    and not robot_voice_enabled):
-                robot_voice_enabled = True
-            elif (not contains(ROBOT_PARAMETERS, parameters)
-                    and robot_voice_enabled):
-                robot_voice_enabled = False
-
-            # Trigger notes as well in demo mode
-            if is_demo:
-                if human_voice_enabled and id_1 != SILENCE_MODULE:
-                    prepare_voice_performance("human", notes_human,
-                                              start_time, end_time)
-                if robot_voice_enabled and id_2 != SILENCE_MODULE:
-                    prepare_voice_performance("robot", notes_robot,
-                                              start_time, end_time)
-
-            # Metronome and count in whenever we come from tacet and enter
-            # robot or human voice module next
-            count_in = False
-            if current_module_index + 1 < total_modules:
-                next_module = modules[current_module_index + 1]
-                next_parameters = next_module["parameters"]
-                if ((contains(HUMAN_PARAMETERS, next_parameters)
-                        or contains(ROBOT_PARAMETERS, next_parameters))
-                        and (not human_voice_enabled and
-                             not robot_voice_enabled)):
-                    count_in = True
-            if count_in:
-                play_count_in()
-            elif human_voice_enabled or robot_voice_enabled:
-                play_beat()
-
-            # Tiny Chronicler is blinking with its eyes sometimes. Beep beep.
-            prepare_blinking(count_in, audio_enabled)
-
-            # Wait for next module
-            await asyncio.sleep(MODULE_DURATION)
-            current_module_index += 1
+        for (cursor, event) in enumerate(timeline.events):
+            # Print some debugging info whenever a module starts
+            while (module_index < len(timeline.modules)
+                    and timeline.modules[module_index] == cursor):
+                logger.debug("=============")
+                logger.debug("Module #{}", module_index)
+                module_index += 1
+
+            await clock.wait_until(event.send_at, event.action)
+            if event.send_at < event.time:
+                # Let the receiver trigger it at the right time
+                with scheduled_at(clock.system_time(event.time)):
+                    ACTIONS[event.action](*event.args)
+            else:
+                ACTIONS[event.action](*event.args)
+
+        await clock.wait_until(timeline.duration, "End")
     except asyncio.CancelledError:
         logger.debug("Performance got cancelled")
     finally:
         logger.debug("Finish performance")
+        clock.report()
+        cancel_held_messages()
         trigger_photo_and_video_stop()
         reset_all()
 
@@ -280,8 +177,14 @@ def perform_composition(title: str,
     logger.debug(
         "Perform composition '{}' (is_demo={}, audio_file={})"
         .format(title, is_demo, audio_file_path))
-    task = asyncio.create_task(
-        perform(audio_file_path, composition_data, is_demo))
+
+    # Prepare all events before the performance starts, sent early enough
+    # for the OSC target with the largest look ahead
+    timeline = compile_timeline(audio_file_path,
+                                composition_data,
+                                is_demo,
+                                osc_output.look_ahead)
+    task = asyncio.create_task(perform(timeline))
 
     # Add task to the set. This creates a strong reference.
     tasks.add(task)
@@ -0,0 +1,191 @@
+from bisect import bisect_left, bisect_right
+from typing import List, NamedTuple, Optional
+
+from tinychronicler.constants import MODULE_DURATION
+from tinychronicler.database import schemas
+from tinychronicler.database.encoding import notes_to_list
+
+SILENCE_MODULE = 0
+HUMAN_PARAMETERS = ["HUMAN_1", "HUMAN_2", "HUMAN_3", "HUMAN_4"]
+ROBOT_PARAMETERS = ["ROBOT_1", "ROBOT_2", "ROBOT_BASS"]
+
+# Actions which only send OSC messages, they can be sent ahead of time
+SCHEDULABLE_ACTIONS = [
+    "stop_media",
+    "video",
+    "photo",
+    "play_audio",
+    "note",
+    "count_in",
+    "beat",
+]
+
+
+class Event(NamedTuple):
+    time: float  # Seconds after start of performance
+    send_at: float  # Earlier than time when sent ahead
+    action: str
+    args: tuple = ()
+    module: Optional[int] = None  # Index of module, not set when preparing
+
+
+class Timeline(NamedTuple):
+    events: List[Event]  # Sorted by the time they are sent at
+    modules: List[int]  # Index of first event of every module
+    duration: float
+
+
+def contains(a, b):
+    for item in a:
+        if item in b:
+            return True
+    return False
+
+
+class VoiceNotes:
+    """
+    Notes of one voice sorted by their start, this way the notes of a module
+    are found without scanning all of them
+    """
+
+    def __init__(self, notes):
+        self.notes = sorted(notes_to_list(notes), key=lambda note: note[1])
+        self.starts = [note[1] for note in self.notes]
+
+    def between(self, start_time: float, end_time: float):
+        return [note for note in self.notes[
+            bisect_left(self.starts, start_time):
+            bisect_right(self.starts, end_time)] if note[2] <= end_time]
+
+
+def compile_timeline(audio_file_path: str,
+                     composition_data: schemas.CompositionData,
+                     is_demo=False,
+                     look_ahead=0.0):
+    """
+    Compiles composition data into a flat list of events sorted by the time
+    they need to be sent at. The performance state machine runs here once,
+    before the performance starts. Events only sending OSC messages are sent
+    the look ahead (in seconds) earlier, the OSC output delivers them at their
+    time
+    """
+    modules = composition_data["parameters"]
+    voices = [VoiceNotes(notes) for notes in composition_data["notes"]]
+    total_modules = len(modules)
+
+    # Performance state
+    video = None
+    photo = None
+    audio_enabled = True
+    human_voice_enabled = True
+    robot_voice_enabled = True
+    count_in = True
+
+    events = []
+
+    def add(time: float, action: str, args=(), module=None):
+        send_at = time
+        if action in SCHEDULABLE_ACTIONS:
+            send_at = max(time - look_ahead, 0.0)
+        events.append(Event(time, send_at, action, args, module))
+
+    # Prepare stage
+    add(0.0, "stop_media")
+    add(0.0, "unmute_narrator")
+    add(0.0, "print_background")
+
+    # Count in!
+    add(MODULE_DURATION, "play_audio", (audio_file_path,))
+    add(MODULE_DURATION, "print_mouth")
+
+    for (index, module) in enumerate(modules):
+        # Modules follow each other after the count in
+        deadline = MODULE_DURATION * (index + 1)
+
+        parameters = module["parameters"]
+        (id_1, id_2, start_time, end_time) = module["module"]
+        media = module["media"] if "media" in module else None
+        media_from = (
+            module["media_from"] if "media_from" in module else None)
+
+        # Performance state machine
+        if "VIDEO" in parameters and video is None:
+            video = media
+            add(deadline, "video", (media, media_from), index)
+        elif "PHOTO" in parameters and photo is None:
+            photo = media
+            add(deadline, "photo", (media,), index)
+        elif ("VIDEO" not in parameters
+                and "PHOTO" not in parameters
+                and (video is not None or photo is not None)):
+            video = None
+            photo = None
+            add(deadline, "stop_media", (), index)
+
+        if ("NARRATOR" in parameters and not audio_enabled):
+            audio_enabled = True
+            add(deadline, "unmute_narrator", (), index)
+        elif ("NARRATOR" not in parameters and audio_enabled):
+            audio_enabled = False
+            add(deadline, "mute_narrator", (), index)
+
+        # Performance state machine for voices (and demo mode)
+        if (contains(HUMAN_PARAMETERS, parameters)
+                and not human_voice_enabled):
+            human_voice_enabled = True
+        elif (not contains(HUMAN_PARAMETERS, parameters)
+                and human_voice_enabled):
+            human_voice_enabled = False
+
+        if (contains(ROBOT_PARAMETERS, parameters)
+                and not robot_voice_enabled):
+            robot_voice_enabled = True
+        elif (not contains(ROBOT_PARAMETERS, parameters)
+                and robot_voice_enabled):
+            robot_voice_enabled = False
+
+        # Trigger notes as well in demo mode, relative to the module's
+        # deadline
+        if is_demo:
+            for (voice, enabled, module_id) in [
+                    ("human", human_voice_enabled, id_1),
+                    ("robot", robot_voice_enabled, id_2)]:
+                if not enabled or module_id == SILENCE_MODULE:
+                    continue
+                notes = voices[0 if voice == "human" else 1]
+                for note in notes.between(start_time, end_time):
+                    add(deadline + note[1] - start_time,
+                        "note",
+                        (voice, note[0]),
+                        index)
+
+        # Metronome and count in whenever we come from tacet and enter
+        # robot or human voice module next
+        count_in = False
+        if index + 1 < total_modules:
+            next_parameters = modules[index + 1]["parameters"]
+            if ((contains(HUMAN_PARAMETERS, next_parameters)
+                    or contains(ROBOT_PARAMETERS, next_parameters))
+                    and (not human_voice_enabled and
+                         not robot_voice_enabled)):
+                count_in = True
+        if count_in:
+            add(deadline, "count_in", (), index)
+        elif human_voice_enabled or robot_voice_enabled:
+            add(deadline, "beat", (), index)
+
+        # Tiny Chronicler is blinking with its eyes sometimes. Beep beep.
+        add(deadline, "blink", (count_in, audio_enabled), index)
+
+    # Sorting is stable, events of the same time keep their order
+    events.sort(key=lambda event: event.send_at)
+
+    module_indices = [None] * total_modules
+    for (event_index, event) in enumerate(events):
+        if event.module is not None and module_indices[event.module] is None:
+            module_indices[event.module] = event_index
+
+    return Timeline(
+        events=events,
+        modules=module_indices,
+        duration=MODULE_DURATION * (total_modules + 1))
@@ -1,3 +1,6 @@
+import json
+from typing import List, Tuple
+
 from sqlalchemy import delete, insert, select, update
 
 from tinychronicler.database import database, models, schemas
@@ -44,6 +47,7 @@ async def delete_chronicle(chronicle_id: int):
     # Delete related files
     files = await get_files(chronicle_id)
     for file in files:
+        await delete_transcripts(file.id)
         remove_file(file)
     # Finally delete chronicle entry
     query = delete(models.Chronicle).where(models.Chronicle.id == chronicle_id)
@@ -80,11 +84,49 @@ async def delete_file(file_id: int):
     # Get file and delete it
     file = await get_file(file_id)
     remove_file(file)
+    # Delete cached transcripts of this file
+    await delete_transcripts(file_id)
     # Delete entry in database
     query = delete(models.File).where(models.File.id == file_id)
     return await database.execute(query)
 
 
+async def create_transcript(transcript: schemas.TranscriptIn, file_id: int):
+    query = insert(models.Transcript).values(
+        content_hash=transcript.content_hash,
+        language=transcript.language,
+        model=transcript.model,
+        words=json.dumps(transcript.words),
+        file_id=file_id,
+    )
+    return await database.execute(query)
+
+
+async def get_transcript(content_hash: str, language: str, model: str):
+    query = select([models.Transcript]).where(
+        (models.Transcript.content_hash == content_hash)
+        & (models.Transcript.language == language)
+        & (models.Transcript.model == model)
+    )
+    return await database.fetch_one(query)
+
+
+async def get_file_transcript(file_id: int, language: str, model: str):
+    query = select([models.Transcript.id]).where(
+        (models.Transcript.file_id == file_id)
+        & (models.Transcript.language == language)
+        & (models.Transcript.model == model)
+    )
+    return await database.fetch_one(query)
+
+
+async def delete_transcripts(file_id: int):
+    query = delete(models.Transcript).where(
+        models.Transcript.file_id == file_id
+    )
+    return await database.execute(query)
+
+
 async def create_composition(
     composition: schemas.CompositionIn, chronicle_id: int
 ):
@@ -94,10 +136,25 @@ async def create_composition(
         is_ready=composition.is_ready,
         title=composition.title,
         version=composition.version,
+        seed=composition.seed,
+        alignment=composition.alignment,
+        score=composition.score,
+        module_count=composition.module_count,
+        duration=composition.duration,
+        media_count=composition.media_count,
     )
     return await database.execute(query)
 
 
+async def create_compositions(
+    compositions: List[schemas.CompositionIn], chronicle_id: int
+):
+    # Insert all compositions at once or none of them
+    async with database.transaction():
+        return [await create_composition(composition, chronicle_id)
+                for composition in compositions]
+
+
 async def get_composition(composition_id: int):
     query = select([models.Composition]).where(
         models.Composition.id == composition_id
@@ -105,11 +162,55 @@ async def get_composition(composition_id: int):
     return await database.fetch_one(query)
 
 
-async def get_compositions(chronicle_id):
-    query = select([models.Composition]).where(
+# Columns of compositions without the (large) data and score
+COMPOSITION_INFO_COLUMNS = [
+    models.Composition.id,
+    models.Composition.created_at,
+    models.Composition.title,
+    models.Composition.is_ready,
+    models.Composition.chronicle_id,
+    models.Composition.version,
+    models.Composition.seed,
+    models.Composition.alignment,
+    models.Composition.module_count,
+    models.Composition.duration,
+    models.Composition.media_count,
+]
+
+
+def get_compositions_query(chronicle_id: int):
+    return select(COMPOSITION_INFO_COLUMNS).where(
         models.Composition.chronicle_id == chronicle_id
     )
-    return await database.fetch_all(query)
+
+
+async def get_composition_info(composition_id: int):
+    query = select(COMPOSITION_INFO_COLUMNS).where(
+        models.Composition.id == composition_id
+    )
+    return await database.fetch_one(query)
+
+
+async def get_composition_data(composition_id: int):
+    # Load data and score only when they are really needed
+    query = select([
+        models.Composition.id,
+        models.Composition.data,
+        models.Composition.version,
+        models.Composition.score,
+    ]).where(models.Composition.id == composition_id)
+    return await database.fetch_one(query)
+
+
+async def get_compositions(chronicle_id: int):
+    return await database.fetch_all(get_compositions_query(chronicle_id))
+
+
+async def has_compositions(chronicle_id: int):
+    query = select([models.Composition.id]).where(
+        models.Composition.chronicle_id == chronicle_id
+    ).limit(1)
+    return await database.fetch_one(query) is not None
 
 
 async def update_composition(
@@ -122,11 +223,35 @@ async def update_composition(
             is_ready=composition.is_ready,
             data=composition.data,
             title=composition.title,
+            version=composition.version,
+            seed=composition.seed,
+            alignment=composition.alignment,
+            score=composition.score,
+            module_count=composition.module_count,
+            duration=composition.duration,
+            media_count=composition.media_count,
         )
     )
     return await database.execute(query)
 
 
+async def update_composition_score(composition_id: int, score: str):
+    query = (
+        update(models.Composition)
+        .where(models.Composition.id == composition_id)
+        .values(score=score)
+    )
+    return await database.execute(query)
+
+
+async def update_compositions(
+    compositions: List[Tuple[int, schemas.CompositionIn]]
+):
+    async with database.transaction():
+        for (composition_id, composition) in compositions:
+            await update_composition(composition_id, composition)
+
+
 async def delete_composition(composition_id: int):
     query = delete(models.Composition).where(
         models.Composition.id == composition_id
@@ -18,9 +18,7 @@ from tinychronicler.constants import (
     THUMBNAIL_SIZE,
     UPLOADS_DIR,
 )
-from tinychronicler.helpers import temporary_file
-
-CHUNK_SIZE_1MB = 1000 * 1000  # in bytes
+from tinychronicler.helpers import CHUNK_SIZE_1MB, temporary_file
 
 
 def create_uploads_dir():
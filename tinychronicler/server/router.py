@@ -1,10 +1,10 @@
-import pickle
+from typing import Optional
 
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     File,
     HTTPException,
+    Query,
     Request,
     Response,
     UploadFile,
@@ -18,11 +18,17 @@ from pydantic import BaseModel
 from sqlalchemy import select
 
 from tinychronicler.constants import (
+    ALIGNMENT,
     ALLOWED_MIME_TYPES,
     ALLOWED_MIME_TYPES_AUDIO,
+    COMPOSITION_BATCH_SIZE,
     TEMPLATES_DIR,
+    AlignmentEnum,
 )
 from tinychronicler.database import database, models, schemas
+from tinychronicler.database.encoding import decode_composition, notes_to_list
+from tinychronicler.generator import model_registry, model_version
+from tinychronicler.io.osc import osc_output
 from tinychronicler.score import (
     create_text_score,
     perform_composition,
@@ -32,7 +38,7 @@ from tinychronicler.version import version
 
 from . import crud, tasks
 from .files import store_file
-from .ws import ws_manager
+from .ws import events_manager, ws_manager
 
 router = APIRouter()
 
@@ -137,8 +143,7 @@ async def create_file(chronicle_id: int, file: UploadFile = File(...)):
             status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
             detail="File format {} is not supported".format(file.content_type),
         )
-    compositions = await crud.get_compositions(chronicle_id)
-    if len(compositions) > 0:
+    if await crud.has_compositions(chronicle_id):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Can not update files when compositions exist",
@@ -171,6 +176,12 @@ async def create_file(chronicle_id: int, file: UploadFile = File(...)):
         ),
         chronicle_id,
     )
+    # Start detecting words in audio files already, so later compositions
+    # are generated faster
+    if upload["file_mime"] in ALLOWED_MIME_TYPES_AUDIO:
+        audio_file = schemas.File.from_orm(await crud.get_file(file_id))
+        tasks.job_queue.transcribe_in_background(audio_file,
+                                                 chronicle.language)
     return {
         "id": file_id,
         "fileName": upload["file_name"],
@@ -211,6 +222,31 @@ async def read_file(chronicle_id: int, file_id: int):
     return result
 
 
+@router.get(
+    "/api/chronicles/{chronicle_id}/files/{file_id}/transcript",
+    response_model=schemas.TranscriptStatusOut,
+    responses={404: {"model": CustomResponse}},
+)
+async def read_transcript_status(chronicle_id: int, file_id: int):
+    file = await crud.get_file(file_id)
+    if file is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
+        )
+    if file.chronicle_id is not chronicle_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File does not belong to chronicle",
+        )
+    chronicle = await crud.get_chronicle(chronicle_id)
+    transcript = await crud.get_file_transcript(
+        file_id, chronicle.language, model_version(chronicle.language))
+    if transcript is not None:
+        return {"status": "ready", "progress": 1.0}
+    return tasks.job_queue.transcript_status.get(
+        file_id, {"status": "none", "progress": 0.0})
+
+
 @router.delete(
     "/api/chronicles/{chronicle_id}/files/{file_id}",
     responses={
@@ -231,23 +267,20 @@ async def delete_file(chronicle_id: int, file_id: int):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="File does not belong to chronicle",
         )
-    compositions = await crud.get_compositions(chronicle_id)
-    if len(compositions) > 0:
+    if await crud.has_compositions(chronicle_id):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Can not update files when compositions exist",
         )
+    tasks.job_queue.cancel_transcription(file_id)
     await crud.delete_file(file_id)
     return Response(status_code=status.HTTP_200_OK)
 
 
-@router.post(
-    "/api/chronicles/{chronicle_id}/compositions",
-    responses={404: {"model": CustomResponse}, 409: {"model": CustomResponse}},
-)
-async def create_composition(
-    chronicle_id: int, background_tasks: BackgroundTasks
-):
+async def enqueue_compositions(chronicle_id: int,
+                               alignment: str,
+                               seed: Optional[int],
+                               count: int):
     chronicle = await crud.get_chronicle(chronicle_id)
     if chronicle is None:
         raise HTTPException(
@@ -260,21 +293,86 @@ async def create_composition(
             status_code=status.HTTP_409_CONFLICT,
             detail="Chronicle needs to contain one audio file",
         )
-    background_tasks.add_task(tasks.generate_composition, chronicle_id)
+    try:
+        await tasks.generate_composition(chronicle_id, alignment, seed, count)
+    except tasks.QueueFullException as err:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(err)
+        )
     return Response(status_code=status.HTTP_202_ACCEPTED)
 
 
+@router.post(
+    "/api/chronicles/{chronicle_id}/compositions",
+    responses={
+        404: {"model": CustomResponse},
+        409: {"model": CustomResponse},
+        429: {"model": CustomResponse},
+    },
+)
+async def create_composition(
+    chronicle_id: int,
+    alignment: AlignmentEnum = ALIGNMENT,
+    seed: Optional[int] = Query(None, ge=0, lt=2 ** 31),
+):
+    return await enqueue_compositions(chronicle_id, alignment, seed, 1)
+
+
+@router.post(
+    "/api/chronicles/{chronicle_id}/compositions/batch",
+    responses={
+        404: {"model": CustomResponse},
+        409: {"model": CustomResponse},
+        429: {"model": CustomResponse},
+    },
+)
+async def create_compositions(
+    chronicle_id: int,
+    count: int = Query(..., ge=1, le=COMPOSITION_BATCH_SIZE),
+    alignment: AlignmentEnum = ALIGNMENT,
+    seed: Optional[int] = Query(None, ge=0, lt=2 ** 31),
+):
+    # Variants share the analysis of the recording, their seeds follow the
+    # given (or a random) one
+    return await enqueue_compositions(chronicle_id, alignment, seed, count)
+
+
 @router.get(
     "/api/chronicles/{chronicle_id}/compositions",
     response_model=Page[schemas.CompositionOut],
 )
 async def read_compositions(chronicle_id: int):
-    return await paginate(
-        database,
-        select([models.Composition]).where(
-            models.Composition.chronicle_id == chronicle_id
-        ),
-    )
+    return await paginate(database, crud.get_compositions_query(chronicle_id))
+
+
+def composition_etag(composition):
+    # Data of a composition never changes once it is ready
+    return '"{}-{}-{}-{}"'.format(composition.id,
+                                  composition.version,
+                                  composition.seed,
+                                  int(composition.is_ready))
+
+
+def is_etag_matching(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+
+async def composition_score(composition, data=None):
+    """
+    Returns the stored text score of a composition, it is rendered and stored
+    for compositions which were generated before scores got stored
+    """
+    if composition.score is not None:
+        return composition.score
+    if data is None:
+        data = decode_composition(composition.data, composition.version)
+    score = create_text_score(data)
+    await crud.update_composition_score(composition.id, score)
+    return score
 
 
 @router.get(
@@ -282,8 +380,11 @@ async def read_compositions(chronicle_id: int):
     response_model=schemas.CompositionDataOut,
     responses={404: {"model": CustomResponse}},
 )
-async def read_composition(chronicle_id: int, composition_id: int):
-    result = await crud.get_composition(composition_id)
+async def read_composition(chronicle_id: int,
+                           composition_id: int,
+                           request: Request,
+                           response: Response):
+    result = await crud.get_composition_info(composition_id)
     if result is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -294,10 +395,22 @@ async def read_composition(chronicle_id: int, composition_id: int):
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Composition does not belong to chronicle",
         )
+
+    # Clients which already know this state of the composition do not need
+    # to load it again
+    etag = composition_etag(result)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if is_etag_matching(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers=headers)
+    response.headers.update(headers)
+
     if result.is_ready:
-        # Convert pickled data before responding
-        data = pickle.loads(result.data)
-        score = create_text_score(data)
+        # Convert stored data before responding
+        composition = await crud.get_composition_data(composition_id)
+        data = decode_composition(composition.data, composition.version)
+        score = await composition_score(composition, data)
+        data["notes"] = [notes_to_list(notes) for notes in data["notes"]]
     else:
         data = None
         score = None
@@ -309,15 +422,37 @@ async def read_composition(chronicle_id: int, composition_id: int):
         "is_ready": result.is_ready,
         "title": result.title,
         "version": result.version,
+        "seed": result.seed,
+        "alignment": result.alignment,
     }
 
 
+@router.get(
+    "/api/chronicles/{chronicle_id}/compositions/{composition_id}/summary",
+    response_model=schemas.CompositionSummaryOut,
+    responses={404: {"model": CustomResponse}},
+)
+async def read_composition_summary(chronicle_id: int, composition_id: int):
+    result = await crud.get_composition_info(composition_id)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Composition not found",
+        )
+    if result.chronicle_id is not chronicle_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Composition does not belong to chronicle",
+        )
+    return result
+
+
 @router.delete(
     "/api/chronicles/{chronicle_id}/compositions/{composition_id}",
     responses={404: {"model": CustomResponse}, 403: {"model": CustomResponse}},
 )
 async def delete_composition(chronicle_id: int, composition_id: int):
-    composition = await crud.get_composition(composition_id)
+    composition = await crud.get_composition_info(composition_id)
     if composition is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -339,7 +474,7 @@ async def delete_composition(chronicle_id: int, composition_id: int):
 async def play_composition(chronicle_id: int,
                            composition_id: int,
                            player_configuration: schemas.PlayerConfiguration):
-    composition = await crud.get_composition(composition_id)
+    composition = await crud.get_composition_info(composition_id)
     if composition is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -365,7 +500,8 @@ async def play_composition(chronicle_id: int,
         audio_file_path = audio_files[0]
 
         # Play it!
-        data = pickle.loads(composition.data)
+        stored = await crud.get_composition_data(composition_id)
+        data = decode_composition(stored.data, stored.version)
         perform_composition(composition.title,
                             audio_file_path,
                             data,
@@ -384,7 +520,7 @@ async def play_composition(chronicle_id: int,
     responses={404: {"model": CustomResponse}, 409: {"model": CustomResponse}},
 )
 async def print_composition(chronicle_id: int, composition_id: int):
-    composition = await crud.get_composition(composition_id)
+    composition = await crud.get_composition_info(composition_id)
     if composition is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -403,8 +539,8 @@ async def print_composition(chronicle_id: int, composition_id: int):
 
     try:
         from tinychronicler.io import print_score
-        data = pickle.loads(composition.data)
-        score = create_text_score(data)
+        stored = await crud.get_composition_data(composition_id)
+        score = await composition_score(stored)
         print_score(composition, score)
     except Exception as err:
         raise HTTPException(
@@ -431,6 +567,31 @@ async def run_io_test(test: schemas.IOTest):
     return Response(status_code=status.HTTP_202_ACCEPTED)
 
 
+@router.get(
+    "/api/settings/models",
+    response_model=schemas.ModelStats,
+)
+async def read_model_stats():
+    stats = model_registry.stats()
+    workers = tasks.job_queue.model_stats
+
+    # Speech recognition runs in worker processes, add up their usage
+    for worker in workers.values():
+        for key in ["memory_used", "hits", "misses", "evictions"]:
+            stats[key] += worker[key]
+        stats["loaded"] = sorted(set(stats["loaded"] + worker["loaded"]))
+        stats["load_times"].update(worker["load_times"])
+    return {**stats, "workers": workers}
+
+
+@router.get(
+    "/api/settings/osc",
+    response_model=schemas.OscStats,
+)
+async def read_osc_stats():
+    return osc_output.stats()
+
+
 @router.post(
     "/api/settings/stop",
     responses={409: {"model": CustomResponse}},
@@ -450,3 +611,8 @@ async def stop_player():
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await ws_manager.handle(websocket)
+
+
+@router.websocket("/ws/events")
+async def websocket_events_endpoint(websocket: WebSocket):
+    await events_manager.handle(websocket)
@@ -4,9 +4,11 @@ from fastapi_pagination import add_pagination
 
 from tinychronicler.constants import STATIC_DIR, UPLOADS_DIR
 from tinychronicler.database import database
+from tinychronicler.io.osc import osc_output
 
 from .files import create_uploads_dir
 from .router import router
+from .tasks import job_queue
 
 # Use FastAPIOffline as we don't want to load OpenAPI static files from CDNs
 server = FastAPIOffline()
@@ -28,8 +30,12 @@ add_pagination(server)
 @server.on_event("startup")
 async def startup():
     await database.connect()
+    await osc_output.start()
+    job_queue.start()
 
 
 @server.on_event("shutdown")
 async def shutdown():
+    await job_queue.stop()
+    osc_output.stop()
     await database.disconnect()
@@ -1,48 +1,405 @@
 import asyncio
-import pickle
-from threading import Thread
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
 
 from loguru import logger
 
+from tinychronicler.constants import (
+    ALIGNMENT,
+    ALLOWED_MIME_TYPES_AUDIO,
+    ASR_WORKERS,
+    COMPOSITION_QUEUE_SIZE,
+    COMPOSITION_WORKERS,
+    TRANSCRIBE_ON_UPLOAD,
+)
 from tinychronicler.database import schemas
-from tinychronicler.generator import generator
+from tinychronicler.database.encoding import (
+    COMPOSITION_VERSION,
+    encode_composition,
+    summarize_composition,
+)
+from tinychronicler.generator import (
+    detect_word_times_parallel,
+    generator,
+    model_registry,
+    model_version,
+    new_seed,
+)
+from tinychronicler.helpers import file_hash
+from tinychronicler.score import create_text_score
 
 from . import crud
+from .ws import events_manager
 
 
-async def generate_composition(chronicle_id: int):
-    async def generate_composition_thread(chronicle_id: int):
+class QueueFullException(Exception):
+    pass
+
+
+# Queue to report progress and model statistics from worker processes to the
+# main process
+progress_queue: multiprocessing.Queue = None
+
+
+def report_model_stats():
+    progress_queue.put(("models", os.getpid(), model_registry.stats()))
+
+
+def setup_worker(memory_budget: int,
+                 language_codes: List[str],
+                 queue: multiprocessing.Queue):
+    global progress_queue
+    progress_queue = queue
+
+    # Every worker process holds its own speech recognition models, make sure
+    # they are configured like the ones of the main process
+    model_registry.memory_budget = memory_budget
+    model_registry.preload(language_codes)
+    report_model_stats()
+
+
+def detect_word_times_with_progress(file_id: int,
+                                    audio_file_path: str,
+                                    language: str,
+                                    workers: int):
+    def report_progress(progress: float):
+        progress_queue.put(("progress", file_id, progress))
+
+    try:
+        return detect_word_times_parallel(audio_file_path,
+                                          language,
+                                          report_progress,
+                                          workers)
+    finally:
+        report_model_stats()
+
+
+class JobQueue:
+    """
+    Generates compositions one after another in a bounded queue. The actual
+    (CPU heavy) generation runs in a pool of worker processes.
+    """
+
+    def __init__(self,
+                 workers: int = COMPOSITION_WORKERS,
+                 max_size: int = COMPOSITION_QUEUE_SIZE):
+        self.workers = workers
+        self.max_size = max_size
+        self.queue: asyncio.Queue = None
+        self.executor: ProcessPoolExecutor = None
+        self.pending: Set[Tuple] = set()  # Requests of waiting jobs
+        self.tasks = set()
+        self.transcribe_on_upload = TRANSCRIBE_ON_UPLOAD
+        self.preload_models: List[str] = []  # Language codes
+        self.asr_workers = ASR_WORKERS
+        self.transcriptions: Dict[int, asyncio.Task] = {}  # by file id
+        self.transcript_status: Dict[int, Dict] = {}  # by file id
+        self.progress_queue: multiprocessing.Queue = None
+        self.progress_task: asyncio.Task = None
+        self.model_stats: Dict[int, Dict] = {}  # by worker process id
+
+    def start(self):
+        self.queue = asyncio.Queue(self.max_size)
+        self.progress_queue = multiprocessing.Queue()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=setup_worker,
+            initargs=(model_registry.memory_budget,
+                      self.preload_models,
+                      self.progress_queue))
+        if len(self.preload_models) > 0:
+            # Start worker processes right away, this way they load the
+            # models before the first job arrives
+            for _ in range(self.workers):
+                self.executor.submit(os.getpid)
+        for _ in range(self.workers):
+            task = asyncio.create_task(self.work())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        self.progress_task = asyncio.create_task(self.receive_progress())
+
+    async def stop(self):
+        # Remove waiting jobs and their pending compositions
+        while not self.queue.empty():
+            job = self.queue.get_nowait()
+            for composition_id in job["composition_ids"]:
+                await crud.delete_composition(composition_id)
+                logger.info("Cancelled generation of composition {}"
+                            .format(composition_id))
+            self.notify("cancelled", job)
+        self.pending.clear()
+
+        # Let workers finish their current job before shutting them down
+        for _ in range(len(self.tasks)):
+            await self.queue.put(None)
+        await asyncio.gather(*self.tasks)
+        await asyncio.gather(*self.transcriptions.values(),
+                             return_exceptions=True)
+        self.executor.shutdown()
+
+        # Stop listening to progress reports
+        self.progress_queue.put(None)
+        await self.progress_task
+
+    async def receive_progress(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.progress_queue.get)
+            if message is None:
+                break
+            (kind, key, value) = message
+            if kind == "models":
+                self.model_stats[key] = value
+            elif key in self.transcript_status:
+                self.set_transcript_status(key, "running", value)
+
+    def set_transcript_status(self,
+                              file_id: int,
+                              status: str,
+                              progress: float):
+        """
+        Updates the status of detecting word times in a file and informs
+        WebSocket clients about it
+        """
+        if status == "done":
+            self.transcript_status.pop(file_id, None)
+        else:
+            self.transcript_status[file_id] = {
+                "status": status,
+                "progress": progress,
+            }
+        events_manager.broadcast_event("transcript",
+                                       file_id=file_id,
+                                       status=status,
+                                       progress=progress)
+
+    def notify(self, status: str, job: Dict, **values):
+        """
+        Informs WebSocket clients about the state of a job, this way they do
+        not need to poll its compositions
+        """
+        events_manager.broadcast_event("job",
+                                       status=status,
+                                       chronicle_id=job["chronicle_id"],
+                                       composition_ids=job["composition_ids"],
+                                       **values)
+
+    async def enqueue(self,
+                      chronicle_id: int,
+                      alignment: str = ALIGNMENT,
+                      seed: Optional[int] = None,
+                      count: int = 1):
+        """
+        Adds a job generating one or more variants of a chronicle's
+        composition. Variants share the analysis of the recording and only
+        differ in their seed
+        """
+        # Ignore job if the same one is already waiting, jobs asking for
+        # other variants of this chronicle are still added
+        key = (chronicle_id, alignment, seed, count)
+        if key in self.pending:
+            logger.debug("Composition for chronicle {} is already pending"
+                         .format(chronicle_id))
+            return
+        if self.queue.full():
+            raise QueueFullException(
+                "Too many compositions are waiting to be generated")
+        self.pending.add(key)
+
+        # Pick seeds already now to show them with the pending compositions
+        if seed is None:
+            seed = new_seed()
+        seeds = [(seed + index) % 2 ** 31 for index in range(count)]
+
+        try:
+            # Insert pending compositions in database
+            chronicle = await crud.get_chronicle(chronicle_id)
+            compositions = [schemas.CompositionIn(title=chronicle.title,
+                                                  data=None,
+                                                  is_ready=False,
+                                                  version=COMPOSITION_VERSION,
+                                                  seed=variant_seed,
+                                                  alignment=alignment)
+                            for variant_seed in seeds]
+            composition_ids = await crud.create_compositions(compositions,
+                                                             chronicle_id)
+        except Exception:
+            self.pending.discard(key)
+            raise
+
+        job = {
+            "chronicle_id": chronicle_id,
+            "composition_ids": composition_ids,
+            "alignment": alignment,
+            "seeds": seeds,
+            "key": key,
+        }
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.pending.discard(key)
+            for composition_id in composition_ids:
+                await crud.delete_composition(composition_id)
+            raise QueueFullException(
+                "Too many compositions are waiting to be generated")
+        self.notify("queued", job)
+
+    async def work(self):
+        while True:
+            job = await self.queue.get()
+            if job is None:
+                break
+            self.pending.discard(job["key"])
+            try:
+                await self.run(job)
+            except Exception as err:
+                logger.error("Failed generating compositions {}: {}"
+                             .format(job["composition_ids"], err))
+                for composition_id in job["composition_ids"]:
+                    await crud.delete_composition(composition_id)
+                self.notify("failed", job, error=str(err))
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job: Dict):
+        chronicle_id = job["chronicle_id"]
+        composition_ids = job["composition_ids"]
+        seeds = job["seeds"]
         logger.info(
-            "Generate new composition based on chronicle {}".format(
-                chronicle_id)
+            "Generate {} new composition(s) based on chronicle {}".format(
+                len(composition_ids), chronicle_id)
         )
 
-        # Insert pending composition in database
         chronicle = await crud.get_chronicle(chronicle_id)
-        title = chronicle.title
-        composition = schemas.CompositionIn(title=title,
-                                            data=None,
-                                            is_ready=False,
-                                            version=1)
-        last_record_id = await crud.create_composition(composition,
-                                                       chronicle_id)
-
-        # Generate composition, this might take some time ..
-        files = await crud.get_files(chronicle_id)
-        data = generator.generate_composition(files, chronicle.language)
-
-        # Update composition with new data and set it ready
-        composition.data = pickle.dumps(data)
-        composition.is_ready = True
-        await crud.update_composition(last_record_id, composition)
+        files = [schemas.File.from_orm(f)
+                 for f in await crud.get_files(chronicle_id)]
+
+        # Detect word times in audio file or take them from an earlier run
+        audio_file = next(
+            f for f in files if f.mime in ALLOWED_MIME_TYPES_AUDIO)
+        self.notify("transcribing", job, file_id=audio_file.id)
+        word_times = await asyncio.shield(
+            self.transcribe(audio_file, chronicle.language))
+
+        # Generate compositions in worker process, this might take some
+        # time ..
+        self.notify("generating", job)
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(self.executor,
+                                             generator.generate_compositions,
+                                             files,
+                                             chronicle.language,
+                                             seeds,
+                                             word_times,
+                                             job["alignment"])
+
+        # Update compositions with new data and set them ready
+        compositions = [(composition_id,
+                         schemas.CompositionIn(title=chronicle.title,
+                                               data=encode_composition(
+                                                   data),
+                                               score=create_text_score(data),
+                                               is_ready=True,
+                                               version=COMPOSITION_VERSION,
+                                               seed=seed,
+                                               alignment=job["alignment"],
+                                               **summarize_composition(data)))
+                        for composition_id, seed, data in zip(
+                            composition_ids, seeds, results)]
+        await crud.update_compositions(compositions)
+        self.notify("ready", job)
         logger.info(
-            "Finished generation of new composition based on chronicle {}"
+            "Finished generation of new composition(s) based on chronicle {}"
             .format(chronicle_id))
 
-    def thread_handler(chronicle_id: int):
-        asyncio.run(generate_composition_thread(chronicle_id))
+    def transcribe(self, audio_file: schemas.File, language: str):
+        """
+        Returns task detecting the word times of an audio file. Only one
+        task runs per file, following calls join the running one
+        """
+        task = self.transcriptions.get(audio_file.id)
+        if task is None:
+            task = asyncio.create_task(
+                self.run_transcription(audio_file, language))
+            self.transcriptions[audio_file.id] = task
+            task.add_done_callback(
+                lambda _: self.transcriptions.pop(audio_file.id, None))
+        return task
+
+    def cancel_transcription(self, file_id: int):
+        """
+        Stops waiting for word times of a file which is about to be deleted
+        """
+        task = self.transcriptions.pop(file_id, None)
+        if task is not None:
+            task.cancel()
+        self.transcript_status.pop(file_id, None)
+
+    def transcribe_in_background(self,
+                                 audio_file: schemas.File,
+                                 language: str):
+        if not self.transcribe_on_upload:
+            return
+        task = self.transcribe(audio_file, language)
+        # Errors are already logged, mark them as retrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def run_transcription(self, audio_file: schemas.File, language: str):
+        loop = asyncio.get_running_loop()
+        content_hash = await loop.run_in_executor(None,
+                                                  file_hash,
+                                                  audio_file.path)
+        model = model_version(language)
+
+        # Speech recognition results are cached per file content, language and
+        # model
+        transcript = await crud.get_transcript(content_hash, language, model)
+        if transcript is not None:
+            logger.info("Use cached word times of file {}"
+                        .format(audio_file.id))
+            return json.loads(transcript.words)
+
+        logger.info("Detect word times of file {}".format(audio_file.id))
+        self.set_transcript_status(audio_file.id, "pending", 0.0)
+        try:
+            word_times = await loop.run_in_executor(
+                self.executor,
+                detect_word_times_with_progress,
+                audio_file.id,
+                audio_file.path,
+                language,
+                self.asr_workers)
+
+            # File might have been deleted during the long run, do not store
+            # a transcript of it then
+            if await crud.get_file(audio_file.id) is not None:
+                await crud.create_transcript(
+                    schemas.TranscriptIn(content_hash=content_hash,
+                                         language=language,
+                                         model=model,
+                                         words=word_times),
+                    audio_file.id)
+        except Exception as err:
+            logger.error("Failed detecting word times of file {}: {}"
+                         .format(audio_file.id, err))
+            self.set_transcript_status(audio_file.id, "failed", 0.0)
+            raise
+
+        # Result is stored in database from now on
+        self.set_transcript_status(audio_file.id, "done", 1.0)
+        logger.info("Finished detecting word times of file {}"
+                    .format(audio_file.id))
+        return word_times
+
+
+job_queue = JobQueue()
+
 
-    # Move it all into a separate thread as loading an large audio file blocks
-    # the main thread
-    new_thread = Thread(target=thread_handler, args=(chronicle_id,))
-    new_thread.start()
+async def generate_composition(chronicle_id: int,
+                               alignment: str = ALIGNMENT,
+                               seed: Optional[int] = None,
+                               count: int = 1):
+    await job_queue.enqueue(chronicle_id, alignment, seed, count)
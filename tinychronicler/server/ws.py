@@ -1,16 +1,20 @@
 import asyncio
-from typing import Set
+import json
+from typing import Set, Union
 
 from fastapi import WebSocket
 from loguru import logger
 from starlette.websockets import WebSocketState
 
 
-async def send(websocket: WebSocket, message: bytes):
+async def send(websocket: WebSocket, message: Union[bytes, str]):
     if websocket.client_state is WebSocketState.DISCONNECTED:
         return
     try:
-        await websocket.send_bytes(message)
+        if isinstance(message, bytes):
+            await websocket.send_bytes(message)
+        else:
+            await websocket.send_text(message)
     except RuntimeError:
         pass
 
@@ -36,9 +40,20 @@ class WebSocketConnectionManager:
         logger.debug("WebSocket client disconnected")
         self.active_connections.remove(websocket)
 
-    def broadcast(self, message: bytes):
+    def broadcast(self, message: Union[bytes, str]):
         for websocket in self.active_connections:
             asyncio.create_task(send(websocket, message))
 
+    def broadcast_event(self, event_type: str, **values):
+        """
+        Sends an event as JSON text message
+        """
+        self.broadcast(json.dumps({"type": event_type, **values}))
 
+
+# Clients receiving OSC messages (as binary messages) during a performance
 ws_manager = WebSocketConnectionManager()
+
+# Clients receiving events about jobs and transcriptions, they are kept apart
+# from the OSC clients which can not parse them
+events_manager = WebSocketConnectionManager()
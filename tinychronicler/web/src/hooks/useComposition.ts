@@ -3,12 +3,14 @@ import { useEffect, useState } from 'react';
 import type { Composition } from '~/types';
 
 import request from '~/utils/api';
+import useEvents from '~/hooks/useEvents';
 
 export default function useComposition(
   chronicleId?: number | string,
   id?: number | string,
 ) {
   const [loading, setLoading] = useState(true);
+  const [revision, setRevision] = useState(0);
 
   const [composition, setComposition] = useState<Composition>({
     created_at: '',
@@ -39,7 +41,18 @@ export default function useComposition(
     };
 
     load();
-  }, [chronicleId, id]);
+  }, [chronicleId, id, revision]);
+
+  // Load composition again as soon as it is ready
+  useEvents((event) => {
+    if (
+      event.type === 'job' &&
+      event.status === 'ready' &&
+      event.composition_ids.includes(Number(id))
+    ) {
+      setRevision((value) => value + 1);
+    }
+  });
 
   return { loading, composition };
 }
@@ -0,0 +1,64 @@
+import { useEffect, useRef } from 'react';
+
+const RECONNECTION_ATTEMPT_INTERVAL = 5000;
+
+export type JobEvent = {
+  type: 'job';
+  status:
+    | 'queued'
+    | 'transcribing'
+    | 'generating'
+    | 'ready'
+    | 'failed'
+    | 'cancelled';
+  chronicle_id: number;
+  composition_ids: number[];
+  error?: string;
+};
+
+export type TranscriptEvent = {
+  type: 'transcript';
+  file_id: number;
+  status: 'pending' | 'running' | 'done' | 'failed';
+  progress: number;
+};
+
+export type ServerEvent = JobEvent | TranscriptEvent;
+
+export default function useEvents(onEvent: (event: ServerEvent) => void) {
+  // Keep latest handler without reconnecting whenever it changes
+  const handler = useRef(onEvent);
+  handler.current = onEvent;
+
+  useEffect(() => {
+    let socket: WebSocket | undefined;
+    let timeout: number | undefined;
+    let closed = false;
+
+    const connect = () => {
+      const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+      socket = new WebSocket(`${protocol}://${window.location.host}/ws/events`);
+
+      socket.onmessage = (message: MessageEvent) => {
+        handler.current(JSON.parse(message.data));
+      };
+
+      socket.onclose = () => {
+        if (closed) {
+          return;
+        }
+
+        // Attempt to re-connect
+        timeout = window.setTimeout(connect, RECONNECTION_ATTEMPT_INTERVAL);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      window.clearTimeout(timeout);
+      socket?.close();
+    };
+  }, []);
+}